@@ -1,17 +1,95 @@
-from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
+import asyncio
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, NamedTuple, Optional, TypeVar
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from config import settings
-from database import get_db
+from database import get_async_db
 from models import User
 from schemas import TokenData
+from utils.jwt_hmac import HmacJWT, TokenError
+from utils.lru import LRUCache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 哈希参数变化（如调高 BCRYPT_ROUNDS）后，旧参数的哈希在用户下次登录时自动重新生成
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+token_codec = HmacJWT(settings.SECRET_KEY, settings.ALGORITHM)
+
+# 已校验令牌缓存：原始令牌字符串 -> TokenData，条目在令牌过期时失效，同一令牌的后续请求不再校验签名
+token_cache = LRUCache(settings.AUTH_TOKEN_CACHE_SIZE)
+
+class CurrentUser(NamedTuple):
+    """已认证用户的身份（get_current_user 的返回值），需要完整用户信息时按 id 查询"""
+    id: int
+    username: str
+
+# 已认证用户身份缓存：令牌 sub（用户名）-> CurrentUser，或 USER_CHANGED（用户被修改/删除后，令牌需重新查库校验）
+# 只在本进程内失效，其他进程的缓存条目最多 AUTH_USER_CACHE_TTL 秒后过期
+USER_CHANGED = object()
+user_cache = LRUCache(settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_USER_CACHE_TTL)
+
+def invalidate_user(username: str):
+    """用户被修改或删除：已签发令牌中的用户ID不再可信，在令牌有效期内都重新查库校验"""
+    user_cache.set(username, USER_CHANGED, ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target: User):
+    history = inspect(target).attrs.username.history
+    for username in (history.deleted or ()):
+        invalidate_user(username)
+    invalidate_user(target.username)
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, target: User):
+    invalidate_user(target.username)
+
+# bcrypt 每次计算占用一个线程 100ms 以上，放在专用线程池中执行，不占用处理其他请求的默认线程池；
+# 排队的哈希计算超过 PASSWORD_HASH_MAX_PENDING 个时直接返回503，避免登录高峰时请求无限堆积
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_hash_executor_lock = threading.Lock()
+_hash_pending = 0
+
+T = TypeVar("T")
+
+def get_hash_executor() -> ThreadPoolExecutor:
+    """获取（必要时创建）密码哈希线程池"""
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is None:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+            )
+        return _hash_executor
+
+def shutdown_hash_executor():
+    """关闭密码哈希线程池"""
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is not None:
+            _hash_executor.shutdown(wait=False, cancel_futures=True)
+            _hash_executor = None
+
+async def run_password_hash(func: Callable[..., T], *args) -> T:
+    """在密码哈希线程池中执行 func，排队已满时抛出503"""
+    global _hash_pending
+    if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="登录请求过多，请稍后再试",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_hash_executor(), func, *args)
+    finally:
+        _hash_pending -= 1
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码"""
@@ -23,40 +101,91 @@ def get_password_hash(password: str) -> str:
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """创建访问令牌"""
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
-
-def authenticate_user(db: Session, username: str, password: str):
-    """验证用户"""
-    user = db.query(User).filter(User.username == username).first()
+    expire_seconds = expires_delta.total_seconds() if expires_delta else 15 * 60
+    return token_codec.encode({**data, "exp": int(time.time() + expire_seconds)})
+
+def create_refresh_token(data: dict) -> str:
+    """创建刷新令牌（带随机 jti，可单独吊销），有效期 REFRESH_TOKEN_EXPIRE_DAYS 天"""
+    expire = time.time() + settings.REFRESH_TOKEN_EXPIRE_DAYS * 86400
+    return token_codec.encode({**data, "type": "refresh", "jti": secrets.token_urlsafe(16), "exp": int(expire)})
+
+def decode_refresh_token(token: str) -> dict:
+    """校验刷新令牌（签名、有效期和令牌类型），返回令牌内容；令牌无效时抛出 ValueError（不检查是否已吊销）"""
+    payload = token_codec.decode(token)
+    if payload.get("type") != "refresh" or not all(payload.get(key) for key in ("sub", "uid", "jti", "exp")):
+        raise TokenError("不是刷新令牌")
+    return payload
+
+def decode_access_token(token: str) -> TokenData:
+    """校验访问令牌，校验通过的令牌缓存到过期为止；令牌无效时抛出 ValueError"""
+    token_data = token_cache.get(token)
+    if token_data is not None:
+        return token_data
+    payload = token_codec.decode(token)
+    if payload.get("type") == "refresh":
+        raise TokenError("刷新令牌不能用于访问接口")
+    username = payload.get("sub")
+    if username is None:
+        raise TokenError("令牌缺少用户名")
+    token_data = TokenData(username=username, user_id=payload.get("uid"))
+    if "exp" in payload:
+        token_cache.set(token, token_data, ttl=payload["exp"] - time.time())
+    return token_data
+
+async def hash_password(password: str) -> str:
+    """在密码哈希线程池中生成密码哈希"""
+    return await run_password_hash(get_password_hash, password)
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    """验证用户（bcrypt 校验在密码哈希线程池中执行），哈希参数已变化时顺便用新参数重新生成哈希"""
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         return False
-    if not verify_password(password, user.password_hash):
+    verified, new_hash = await run_password_hash(pwd_context.verify_and_update, password, user.password_hash)
+    if not verified:
         return False
+    if new_hash:
+        # 直接 UPDATE 不触发 User 的 after_update 事件：只换了哈希，已签发令牌的身份仍然有效
+        await db.execute(update(User).where(User.id == user.id).values(password_hash=new_hash))
+        await db.commit()
+        user.password_hash = new_hash
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """获取当前用户"""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> CurrentUser:
+    """
+    获取当前用户身份
+    令牌校验结果按令牌缓存；令牌带用户ID（uid）时直接使用，不查询用户表；旧令牌（只有 sub）或用户被修改过时查库，结果缓存 AUTH_USER_CACHE_TTL 秒
+    """
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
+        token_data = decode_access_token(token)
+    except ValueError:
+        raise _credentials_exception()
+    return await resolve_user(db, token_data)
+
+async def resolve_user(db: AsyncSession, token_data: TokenData, trust_uid: bool = True) -> CurrentUser:
+    """
+    确认令牌中的用户仍然有效，无效时抛出401
+    trust_uid=False 时（用刷新令牌换取访问令牌）身份缓存未命中就查库，不直接使用令牌中的用户ID
+    """
+    cached = user_cache.get(token_data.username)
+    if isinstance(cached, CurrentUser) and token_data.user_id in (None, cached.id):
+        return cached
+    if trust_uid and cached is None and token_data.user_id is not None:
+        return CurrentUser(token_data.user_id, token_data.username)
+    
+    row = (await db.execute(
+        select(User.id, User.username).where(User.username == token_data.username)
+    )).first()
+    if row is None or token_data.user_id not in (None, row.id):
+        raise _credentials_exception()
+    user = CurrentUser(row.id, row.username)
+    if cached is not USER_CHANGED:
+        user_cache.set(user.username, user)
     return user
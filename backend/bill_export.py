@@ -0,0 +1,100 @@
+"""
+账单导出（CSV / NDJSON，可选 gzip 压缩）
+只查询导出需要的列，通过服务端游标每次取 EXPORT_CHUNK_SIZE 行，逐块编码后直接写入响应：
+不构造 ORM 对象和 Pydantic 模型，内存占用与导出的账单数无关，第一块数据取出后就开始返回
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional, Sequence
+
+from sqlalchemy import select
+
+from models import Bill
+
+EXPORT_COLUMNS = (
+    Bill.id, Bill.bill_date, Bill.title, Bill.amount, Bill.category, Bill.type,
+    Bill.description, Bill.created_at, Bill.updated_at
+)
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+EXPORT_CHUNK_SIZE = 1000
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+def export_statement(
+    user_id: int,
+    category: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+):
+    """导出查询：按账单日期、ID升序（走 idx_user_date_id 索引），yield_per 让驱动使用服务端游标分块读取"""
+    query = select(*EXPORT_COLUMNS).where(Bill.user_id == user_id)
+    if category:
+        query = query.where(Bill.category == category)
+    if start_date:
+        query = query.where(Bill.bill_date >= start_date)
+    if end_date:
+        query = query.where(Bill.bill_date <= end_date)
+    return query.order_by(Bill.bill_date, Bill.id).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+
+def export_filename(fmt: str, compress: bool) -> str:
+    return f"bills.{fmt}.gz" if compress else f"bills.{fmt}"
+
+def _json_default(value):
+    # 与 BillResponse 的JSON输出一致：金额为字符串，日期时间为ISO格式
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+class BillExportEncoder:
+    """把账单行逐块编码为 CSV / NDJSON 字节串，compress=True 时输出 gzip 流"""
+
+    def __init__(self, fmt: str, compress: bool = False):
+        if fmt not in MEDIA_TYPES:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        self.fmt = fmt
+        # wbits=31 输出带 gzip 头的流；每块 Z_SYNC_FLUSH，客户端不必等压缩缓冲区填满就能收到数据
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+
+    def _output(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        if self._compressor is not None:
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def start(self) -> bytes:
+        """CSV 表头（带 BOM，Excel 打开中文不乱码）；NDJSON 没有表头"""
+        if self.fmt != "csv":
+            return b""
+        self._writer.writerow(EXPORT_FIELDS)
+        return self._output("\ufeff" + self._take())
+
+    def encode(self, rows: Sequence[Sequence]) -> bytes:
+        if self.fmt == "csv":
+            self._writer.writerows(rows)
+            text = self._take()
+        else:
+            text = "".join(
+                json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False, default=_json_default) + "\n"
+                for row in rows
+            )
+        return self._output(text)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush() if self._compressor is not None else b""
+
+    def _take(self) -> str:
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text
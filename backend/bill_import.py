@@ -0,0 +1,155 @@
+"""
+账单批量导入（POST /api/bills/bulk 与 CSV 导入共用）
+每批最多 BILL_IMPORT_CHUNK_SIZE 条：逐条用 BillCreate 校验，校验通过的账单用一条批量 INSERT（executemany）写入，
+按汇总行合并更新按月汇总表后提交。校验或写入失败的行记录行号和原因，不影响同批其他行；
+带交易单号（external_id）的账单已导入过时跳过。
+文件读到中途出错（编码错误、CSV格式错误）时停止读取，已读到的行照常导入，结果的 error 记录原因
+"""
+import csv
+import io
+from itertools import islice
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import Bill
+from rollup import apply_rollup_rows
+from schemas import BillCreate, BillImportError, BillImportResult
+
+MAX_REPORTED_ERRORS = 100
+REQUIRED_COLUMNS = [name for name, field in BillCreate.model_fields.items() if field.is_required()]
+
+# (行号, 账单字段字典)
+ImportRow = Tuple[int, Dict]
+
+class ImportReport:
+    """累计导入结果，错误明细只保留前 MAX_REPORTED_ERRORS 条"""
+
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.skipped = 0
+        self.errors: List[BillImportError] = []
+        self.error: Optional[str] = None  # 读取中断的原因
+
+    def add_error(self, row: int, error: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(BillImportError(row=row, error=error))
+
+    def result(self) -> BillImportResult:
+        return BillImportResult(
+            created=self.created, failed=self.failed, skipped=self.skipped, errors=self.errors, error=self.error
+        )
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+    )
+
+def _read_batch(items: Iterator[ImportRow], report: ImportReport) -> List[ImportRow]:
+    """
+    读取下一批原始行；读取出错时保留已读到的行，原因记入 report.error
+    前面的批次已经提交，不能再整体返回400
+    """
+    batch = []
+    try:
+        for item in islice(items, settings.BILL_IMPORT_CHUNK_SIZE):
+            batch.append(item)
+    except UnicodeDecodeError:
+        report.error = "文件编码错误"
+    except (ValueError, csv.Error) as e:
+        report.error = str(e)
+    if report.error and batch:
+        report.error = f"读取到第 {batch[-1][0]} 行后中断，之后的行未导入: {report.error}"
+    return batch
+
+def next_chunk(items: Iterator[ImportRow], user_id: int, report: ImportReport,
+               schema: Type[BillCreate] = BillCreate) -> Optional[List[ImportRow]]:
+    """
+    取下一批原始行按 schema 校验，返回校验通过的账单（可能为空列表）
+    items 已取完或上一批读取中断时返回 None
+    """
+    if report.error:
+        return None
+    batch = _read_batch(items, report)
+    if not batch:
+        return None
+    rows = []
+    for line, raw in batch:
+        try:
+            bill = schema.model_validate(raw)
+        except ValidationError as e:
+            report.add_error(line, _validation_message(e))
+            continue
+        rows.append((line, {**bill.model_dump(), "user_id": user_id}))
+    return rows
+
+def _insert(db: Session, values: List[Dict]):
+    db.execute(insert(Bill.__table__), values)
+    apply_rollup_rows(db.connection(), values)  # 批量插入绕过了ORM事件
+    db.commit()
+
+def _drop_imported(db: Session, rows: List[ImportRow], report: ImportReport) -> List[ImportRow]:
+    """去掉交易单号已导入过（包括本批前面出现过）的账单"""
+    external_ids = {values["external_id"] for _, values in rows if values.get("external_id")}
+    if not external_ids:
+        return rows
+    seen = set(db.scalars(select(Bill.external_id).where(
+        Bill.user_id == rows[0][1]["user_id"],
+        Bill.external_id.in_(external_ids)
+    )))
+    kept = []
+    for line, values in rows:
+        external_id = values.get("external_id")
+        if external_id:
+            if external_id in seen:
+                report.skipped += 1
+                continue
+            seen.add(external_id)
+        kept.append((line, values))
+    return kept
+
+def insert_chunk(db: Session, rows: List[ImportRow], report: ImportReport):
+    """一批账单一条批量INSERT并提交；整批写入失败时逐条重试，找出出错的行"""
+    rows = _drop_imported(db, rows, report)
+    if not rows:
+        return
+    try:
+        _insert(db, [values for _, values in rows])
+        report.created += len(rows)
+        return
+    except SQLAlchemyError:
+        db.rollback()
+
+    for line, values in rows:
+        try:
+            _insert(db, [values])
+            report.created += 1
+        except SQLAlchemyError as e:
+            db.rollback()
+            report.add_error(line, str(getattr(e, "orig", None) or e).splitlines()[0])
+
+def json_rows(items: Iterable[Dict]) -> Iterator[ImportRow]:
+    return enumerate(items, start=1)
+
+def csv_rows(file: BinaryIO) -> Iterator[ImportRow]:
+    """
+    逐行读取CSV（UTF-8，可带BOM），表头需包含 BillCreate 的必填字段，多余的列忽略（可直接导入导出的CSV）
+    表头缺少必填列时抛出 ValueError
+    """
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV缺少列: {', '.join(missing)}")
+    return _csv_items(reader)
+
+def _csv_items(reader: csv.DictReader) -> Iterator[ImportRow]:
+    for raw in reader:
+        if raw.get("description") == "":
+            raw["description"] = None
+        yield reader.line_num, raw
@@ -0,0 +1,150 @@
+"""
+上传图片的内容寻址存储
+相同内容的图片只保存一份（uploads/blobs/<sha256前两位>/<sha256>-<随机后缀><扩展名>），
+由 image_blobs.ref_count 记录被多少条 BillImage 引用，引用归零时删除文件。
+文件在插入 image_blobs 记录后移入，事务回滚时删除；随机后缀保证引用归零后重新上传的同一内容
+不会与正在删除的旧文件同名
+"""
+import hashlib
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import BillImage, ImageBlob
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = Path("uploads")
+BLOB_DIR = UPLOAD_DIR / "blobs"
+STAGING_DIR = UPLOAD_DIR / "tmp"
+STORE_ATTEMPTS = 3  # 并发上传同一内容、对方回滚时重新插入的次数
+
+class StagedUpload(NamedTuple):
+    """已写入临时文件、计算好摘要的上传文件"""
+    tmp_path: str
+    content_hash: str
+    file_size: int
+    file_ext: str
+
+def stage_upload(file: UploadFile, file_ext: str, chunk_size: int = 1024 * 1024) -> StagedUpload:
+    """边写临时文件边计算SHA-256，只读取一遍上传内容"""
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    sha256 = hashlib.sha256()
+    file_size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=STAGING_DIR, suffix=file_ext)
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            for chunk in iter(lambda: file.file.read(chunk_size), b""):
+                sha256.update(chunk)
+                buffer.write(chunk)
+                file_size += len(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return StagedUpload(tmp_path, sha256.hexdigest(), file_size, file_ext)
+
+def discard_staged(staged: StagedUpload):
+    """删除临时文件"""
+    try:
+        os.remove(staged.tmp_path)
+    except OSError:
+        pass
+
+def find_duplicate_image(db: Session, user_id: int, content_hash: str) -> Optional[BillImage]:
+    """查找该用户内容相同的已上传图片（走 user_id + content_hash 索引）"""
+    return db.query(BillImage).filter(
+        BillImage.user_id == user_id,
+        BillImage.content_hash == content_hash
+    ).order_by(BillImage.id).first()
+
+def blob_path(content_hash: str, file_ext: str) -> Path:
+    return BLOB_DIR / content_hash[:2] / f"{content_hash}-{secrets.token_hex(4)}{file_ext}"
+
+def store_blob(db: Session, staged: StagedUpload) -> ImageBlob:
+    """
+    保存文件内容并增加引用计数（不提交事务）
+    内容已存在时只增加引用计数并丢弃临时文件；新内容插入记录后把临时文件移入，事务回滚时删除
+    """
+    for _ in range(STORE_ATTEMPTS):
+        blob = _acquire_existing(db, staged.content_hash)
+        if blob is not None:
+            discard_staged(staged)
+            return blob
+
+        blob = ImageBlob(
+            content_hash=staged.content_hash,
+            file_path=str(blob_path(staged.content_hash, staged.file_ext)),
+            file_size=staged.file_size,
+            ref_count=1
+        )
+        try:
+            # 并发上传同一内容时唯一索引冲突：对方已提交则下一轮增加引用计数，对方回滚则重新插入
+            with db.begin_nested():
+                db.add(blob)
+        except IntegrityError:
+            continue
+
+        path = Path(blob.file_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(staged.tmp_path, path)
+        db.info.setdefault("stored_blob_files", []).append(blob.file_path)
+        return blob
+
+    discard_staged(staged)
+    raise RuntimeError("保存图片文件失败：并发上传同一内容冲突")
+
+def _acquire_existing(db: Session, content_hash: str) -> Optional[ImageBlob]:
+    updated = db.query(ImageBlob).filter(
+        ImageBlob.content_hash == content_hash
+    ).update({ImageBlob.ref_count: ImageBlob.ref_count + 1}, synchronize_session=False)
+    if not updated:
+        return None
+    return db.query(ImageBlob).filter(ImageBlob.content_hash == content_hash).first()
+
+@event.listens_for(BillImage, "after_delete")
+def _release_blob(mapper, connection, target: BillImage):
+    """图片记录删除时（包括随账单级联删除）减少引用计数，归零后在事务提交时删除文件"""
+    if not target.content_hash:
+        return
+
+    blobs = ImageBlob.__table__
+    connection.execute(
+        blobs.update()
+        .where(blobs.c.content_hash == target.content_hash)
+        .values(ref_count=blobs.c.ref_count - 1)
+    )
+    row = connection.execute(
+        blobs.select().where(blobs.c.content_hash == target.content_hash)
+    ).first()
+    if row is not None and row.ref_count <= 0:
+        connection.execute(blobs.delete().where(blobs.c.id == row.id))
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault("released_blob_files", []).append(row.file_path)
+
+def _remove_files(file_paths):
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except OSError:
+            logger.warning("删除图片文件失败: %s", file_path)
+
+@event.listens_for(Session, "after_commit")
+def _remove_released_files(session: Session):
+    session.info.pop("stored_blob_files", None)
+    _remove_files(session.info.pop("released_blob_files", []))
+
+@event.listens_for(Session, "after_rollback")
+def _forget_released_files(session: Session):
+    """回滚时保留引用未归零的文件，删除本事务移入、记录已撤销的文件"""
+    session.info.pop("released_blob_files", None)
+    _remove_files(session.info.pop("stored_blob_files", []))
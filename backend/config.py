@@ -7,15 +7,61 @@ class Settings(BaseSettings):
     DB_USER: str = "root"
     DB_PASSWORD: str = "password"
     DB_NAME: str = "billing_system"
+    DATABASE_URL: str = ""  # 完整的数据库连接串（如 sqlite:///./test.db），设置后忽略上面的 DB_* 配置
+    
+    # 数据库连接池配置（同步连接池和异步连接池各按此大小创建，每个进程各有一套）
+    DB_POOL_SIZE: int = 10  # 常驻连接数
+    DB_MAX_OVERFLOW: int = 20  # 连接全部占用时最多额外创建的连接数
+    DB_POOL_TIMEOUT: float = 10.0  # 连接池耗尽时等待空闲连接的秒数，超时抛出异常
+    DB_POOL_RECYCLE: int = 3600  # 连接使用超过该秒数后重建（应小于MySQL wait_timeout），-1 表示不重建
+    DB_PRE_PING: str = "idle"  # 取出连接前是否先检测可用：always（每次）/ never / idle（空闲超过 DB_PRE_PING_IDLE 秒时）
+    DB_PRE_PING_IDLE: float = 30.0
     
     # JWT配置
     SECRET_KEY: str = "your-secret-key-change-this-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 14  # 刷新令牌有效天数（用于换取新的访问令牌，不必重新输入密码）
+    TOKEN_REVOCATION_SYNC_INTERVAL: float = 5.0  # 从数据库同步其他进程吊销的刷新令牌的间隔（秒）
+    AUTH_TOKEN_CACHE_SIZE: int = 10000  # 已校验令牌缓存的最大条目数（条目在令牌过期时失效）
+    AUTH_USER_CACHE_SIZE: int = 10000  # 已认证用户身份缓存的最大条目数
+    AUTH_USER_CACHE_TTL: float = 60.0  # 身份缓存条目的过期秒数
+    BCRYPT_ROUNDS: int = 12  # bcrypt 计算轮数（每加1耗时翻倍），修改后旧密码哈希在用户登录时自动按新轮数重新生成
+    PASSWORD_HASH_WORKERS: int = 2  # 密码哈希专用线程数（注册/登录的 bcrypt 计算在这些线程中执行）
+    PASSWORD_HASH_MAX_PENDING: int = 64  # 等待和正在计算的密码哈希超过该数时，注册/登录直接返回503
     
     # CORS配置
     CORS_ORIGINS: list = ["http://localhost:5173", "http://localhost:3000"]
     
+    # 账单批量导入配置
+    BILL_IMPORT_CHUNK_SIZE: int = 5000  # 批量导入每批写入的账单数（每批一条批量INSERT并提交一次）
+    BILL_BULK_MAX_ROWS: int = 10000  # POST /api/bills/bulk 单次最多提交的账单数（更多请用CSV导入）
+    
+    # 按月汇总表配置
+    ROLLUP_VERIFY_ON_STARTUP: bool = False  # 启动时比对账单表与按月汇总表（扫描账单表），不一致时重建；汇总表新建时总会回填
+    
+    # OCR配置
+    OCR_ENABLED: bool = True  # 关闭时不加载图片上传/OCR相关模块，只提供认证和账单接口
+    OCR_PRELOAD: bool = False  # 启动时预先启动OCR进程池并加载模型，否则首次使用时加载
+    
+    # OCR任务队列配置
+    OCR_EMBEDDED_WORKER: bool = True  # 是否在API进程内启动OCR任务调度（否则单独运行 ocr_worker.py）
+    OCR_WORKER_PROCESSES: int = 2  # OCR进程池大小（后台任务与批量同步解析共用）
+    OCR_JOB_POLL_INTERVAL: float = 1.0  # 轮询任务队列的间隔（秒）
+    OCR_JOB_TIMEOUT: int = 300  # 任务处于running状态超过该秒数视为中断，重新入队
+    OCR_JOB_MAX_ATTEMPTS: int = 3  # 单个任务最大尝试次数
+    OCR_REC_BATCH_NUM: int = 16  # 文本识别/方向分类每批处理的文本行数
+    OCR_PREPROCESS_PROFILE: str = "auto"  # 预处理方案：none / fast / full / auto（见 utils/preprocess.py）
+    OCR_TARGET_TEXT_HEIGHT: int = 32  # fast/auto 方案按文字行高缩小图片的目标行高（像素）
+    OCR_TARGET_LONG_SIDE: int = 1600  # 无法估计文字行高时缩小到的目标长边（像素），小于该值的图片不缩放
+    OCR_ROI_CROP: bool = True  # fast/auto 方案是否裁掉空白边距，并在已知账单类型时只保留字段区域
+    REPARSE_CHUNK_SIZE: int = 200  # 批量重新解析每批处理的图片数（每批提交一次进度）
+    
+    # OCR结果缓存配置
+    OCR_CACHE_MEMORY_SIZE: int = 512  # 内存LRU最大条目数
+    OCR_CACHE_DIR: str = "uploads/.ocr_cache"  # 磁盘缓存目录，留空则只使用内存缓存
+    OCR_CACHE_DISK_MAX_BYTES: int = 512 * 1024 * 1024  # 磁盘缓存总大小上限，超过时删除最久未用的结果，0 表示不限
+    
     class Config:
         env_file = ".env"
 
@@ -1,14 +1,155 @@
-from sqlalchemy import create_engine
+import json
+import threading
+import time
+from typing import Dict
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from config import settings
 
-# 创建数据库连接
-DATABASE_URL = f"mysql+pymysql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}?charset=utf8mb4"
+# 创建数据库连接（设置 DATABASE_URL 时优先使用，如本地测试用 sqlite:///./test.db）
+DATABASE_URL = settings.DATABASE_URL or f"mysql+pymysql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}?charset=utf8mb4"
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=3600)
+# 同步驱动对应的异步驱动（同一个数据库，API路由使用异步连接）
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+PRE_PING_POLICIES = ("always", "never", "idle")
+
+def _async_url(url: str) -> str:
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
+def _json_serializer(obj) -> str:
+    """JSON列序列化：OCR结果中的金额为Decimal，按字符串保存"""
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+class _PoolMetricsMixin:
+    """
+    记录连接池取连接的次数、等待耗时、超时次数和溢出连接的峰值
+    取连接耗时包括等待空闲连接、新建连接和连接检测（pre-ping）的时间
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._overflow_peak = 0
+        self.pre_pings = 0
+        self.pre_ping_failures = 0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            with self._metrics_lock:
+                self._timeouts += 1
+            raise
+        wait = time.perf_counter() - start
+        overflow = self.overflow()
+        with self._metrics_lock:
+            self._checkouts += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._overflow_peak = max(self._overflow_peak, overflow)
+        return connection
+
+    def metrics(self) -> Dict:
+        with self._metrics_lock:
+            return {
+                "pool_size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(0, self.overflow()),
+                "overflow_peak": max(0, self._overflow_peak),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "pre_pings": self.pre_pings,
+                "pre_ping_failures": self.pre_ping_failures,
+            }
+
+class MeteredQueuePool(_PoolMetricsMixin, QueuePool):
+    pass
+
+class MeteredAsyncAdaptedQueuePool(_PoolMetricsMixin, AsyncAdaptedQueuePool):
+    pass
+
+def _install_idle_pre_ping(engine: Engine, idle_seconds: float):
+    """
+    连接空闲超过 idle_seconds 才在取出时检测可用性：
+    连接被频繁复用时省掉每次取连接多一次的往返，长时间未用（可能已被服务端断开）的连接仍会检测
+    """
+    @event.listens_for(engine, "checkin")
+    def _record_checkin(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def _ping_idle(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.get("checked_in_at")
+        if checked_in_at is None or time.monotonic() - checked_in_at < idle_seconds:
+            return
+        pool = engine.pool
+        pool.pre_pings += 1
+        try:
+            alive = engine.dialect.do_ping(dbapi_connection)
+        except Exception:
+            alive = False
+        if not alive:
+            pool.pre_ping_failures += 1
+            # 连接池丢弃该连接并重新取出
+            raise exc.DisconnectionError("连接空闲后已断开")
+
+def _engine_options(poolclass) -> Dict:
+    if settings.DB_PRE_PING not in PRE_PING_POLICIES:
+        raise ValueError(f"未知的 DB_PRE_PING: {settings.DB_PRE_PING}，可选 {', '.join(PRE_PING_POLICIES)}")
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_PRE_PING == "always",
+        "json_serializer": _json_serializer,
+    }
+
+# 同步连接：建表、OCR后台任务、批量重新解析等在线程中运行的代码使用
+engine = create_engine(DATABASE_URL, **_engine_options(MeteredQueuePool))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步连接：API路由使用，等待数据库时不阻塞事件循环
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(MeteredAsyncAdaptedQueuePool))
+# 提交后不过期对象：异步会话中访问过期属性会触发隐式IO而报错
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+if settings.DB_PRE_PING == "idle":
+    _install_idle_pre_ping(engine, settings.DB_PRE_PING_IDLE)
+    _install_idle_pre_ping(async_engine.sync_engine, settings.DB_PRE_PING_IDLE)
+
+def pool_metrics() -> Dict:
+    """当前进程两个连接池的使用情况"""
+    return {
+        "pre_ping": settings.DB_PRE_PING,
+        "sync": engine.pool.metrics(),
+        "async": async_engine.sync_engine.pool.metrics(),
+    }
+
 Base = declarative_base()
 
 # 依赖注入：获取数据库会话
@@ -18,3 +159,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# 依赖注入：获取异步数据库会话
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,11 +1,35 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import inspect
 from config import settings
-from database import engine, Base
-from routers import auth, bills, images
+from auth import shutdown_hash_executor
+from database import engine, async_engine, Base, SessionLocal, pool_metrics
+from request_metrics import (
+    RequestMetricsMiddleware,
+    TimedRoute,
+    instrument_engine,
+    render_pool_metrics,
+    request_metrics
+)
+from models import BillMonthlyRollup
+from rollup import ensure_rollups
+from routers import auth, bills
+from schema_upgrade import upgrade_schema
+import blob_store  # noqa: F401  注册图片文件引用计数事件（删除账单时级联释放图片文件）
+
+# OCR关闭时不导入图片路由和OCR任务模块，仅提供认证和账单接口
+if settings.OCR_ENABLED:
+    from routers import images
+    from ocr_worker import dispatcher, preload_ocr_workers
+    from reparse import resume_reparse_jobs, stop_reparse_jobs
+
+# 汇总表是否由本次启动新建（升级后首次启动），新建时按账单表回填
+rollups_created = not inspect(engine).has_table(BillMonthlyRollup.__tablename__)
 
-# 创建数据库表
+# 创建数据库表，并为已有表补齐新增的列和索引
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine, Base.metadata)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -13,6 +37,7 @@ app = FastAPI(
     description="基于 FastAPI 的用户账单管理系统后端接口",
     version="1.0.0"
 )
+app.router.route_class = TimedRoute  # 下面直接定义在 app 上的路由同样按路由模板统计
 
 # 配置CORS
 app.add_middleware(
@@ -21,12 +46,61 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # 账单列表的下一页游标
 )
 
+# 按路由统计请求耗时和SQL执行耗时（GET /metrics）
+app.add_middleware(RequestMetricsMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
 # 注册路由
 app.include_router(auth.router)
 app.include_router(bills.router)
-app.include_router(images.router)
+if settings.OCR_ENABLED:
+    app.include_router(images.router)
+
+@app.on_event("startup")
+def check_rollups():
+    """
+    汇总表刚创建时按账单表回填，否则统计接口的整月部分会少算；
+    设置 ROLLUP_VERIFY_ON_STARTUP 时比对两表（扫描账单表），不一致才重建
+    """
+    if not (rollups_created or settings.ROLLUP_VERIFY_ON_STARTUP):
+        return
+    db = SessionLocal()
+    try:
+        ensure_rollups(db, verify=not rollups_created)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def start_ocr_worker():
+    """启动OCR后台任务调度，按需预加载OCR模型"""
+    if not settings.OCR_ENABLED:
+        return
+    if settings.OCR_EMBEDDED_WORKER:
+        dispatcher.start()
+        resume_reparse_jobs()
+    if settings.OCR_PRELOAD:
+        preload_ocr_workers()
+
+@app.on_event("shutdown")
+def stop_ocr_worker():
+    """停止OCR后台任务调度和批量重新解析（未完成的任务下次启动时继续）"""
+    if settings.OCR_ENABLED:
+        stop_reparse_jobs()
+        dispatcher.stop()
+
+@app.on_event("shutdown")
+def stop_password_hashing():
+    """关闭密码哈希线程池"""
+    shutdown_hash_executor()
+
+@app.on_event("shutdown")
+async def close_database():
+    """关闭异步数据库连接池"""
+    await async_engine.dispose()
 
 @app.get("/")
 def root():
@@ -38,6 +112,17 @@ def health_check():
     """健康检查"""
     return {"status": "healthy"}
 
+@app.get("/metrics/db")
+def database_metrics():
+    """数据库连接池使用情况（当前进程），用于按worker调整连接池大小"""
+    return pool_metrics()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus 文本格式的请求统计（按路由的请求数、耗时直方图、各阶段耗时）和连接池指标（当前进程）"""
+    lines = request_metrics.render() + render_pool_metrics(pool_metrics())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
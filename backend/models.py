@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DECIMAL, Date, DateTime, ForeignKey, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DECIMAL, Date, DateTime, ForeignKey, JSON, Boolean, Index, Float, LargeBinary, UniqueConstraint
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 from database import Base
 
@@ -15,6 +15,15 @@ class User(Base):
     
     bills = relationship("Bill", back_populates="user", cascade="all, delete-orphan")
 
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)  # 自增ID，各进程按ID增量同步吊销列表
+    jti = Column(String(64), unique=True, nullable=False)  # 刷新令牌ID
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)  # 令牌本身的过期时间，过期后记录可以删除
+    created_at = Column(DateTime, default=datetime.utcnow)  # 吊销时间
+
 class Bill(Base):
     __tablename__ = "bills"
     
@@ -26,11 +35,36 @@ class Bill(Base):
     type = Column(String(50), nullable=False)  # 类型：餐饮、交通、工资等
     description = Column(Text)
     bill_date = Column(Date, nullable=False, index=True)
+    external_id = Column(String(64))  # 支付宝/微信交易单号（从账单明细导入的账单），同一用户内唯一，用于重复导入时去重
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     user = relationship("User", back_populates="bills")
     images = relationship("BillImage", back_populates="bill", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # 统计查询的覆盖索引：按用户和日期范围过滤，收支分类、消费类型和金额直接从索引读取
+        Index("idx_user_date_category_type_amount", "user_id", "bill_date", "category", "type", "amount"),
+        # 账单列表按 (bill_date, id) 倒序的游标分页
+        Index("idx_user_date_id", "user_id", "bill_date", "id"),
+        UniqueConstraint("user_id", "external_id", name="uq_bill_user_external_id"),
+    )
+
+class BillMonthlyRollup(Base):
+    """账单按月汇总（由 rollup.py 随账单增删改在同一事务内维护）"""
+    __tablename__ = "bill_monthly_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    month = Column(Date, nullable=False)  # 月份第一天
+    category = Column(String(50), nullable=False)  # 收入/支出
+    type = Column(String(50), nullable=False)
+    total_amount = Column(DECIMAL(14, 2), nullable=False, default=0)
+    bill_count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "month", "category", "type", name="uq_rollup_user_month_category_type"),
+    )
 
 class BillImage(Base):
     __tablename__ = "bill_images"
@@ -43,10 +77,76 @@ class BillImage(Base):
     file_size = Column(Integer, nullable=False)
     mime_type = Column(String(100), nullable=False)
     source_type = Column(String(50))  # alipay/wechat/manual
-    ocr_result = Column(JSON)  # OCR识别结果
+    ocr_result = Column(JSON)  # 解析结果（账单类型、解析出的字段、错误、耗时）
+    # OCR原始文本行（utils/ocr_lines.py 编码），体积较大，只在访问时加载
+    ocr_lines = deferred(Column(LargeBinary(length=16 * 1024 * 1024)))
+    ocr_model_version = Column(String(255))  # 产生 ocr_lines 的OCR版本（模型 + 预处理参数）
+    parser_version = Column(String(20))  # 产生 ocr_result 的解析规则版本
     parse_status = Column(String(50), default="pending", index=True)  # pending/success/failed
     parse_error = Column(Text)
+    content_hash = Column(String(64))  # 图片内容SHA-256，对应 image_blobs.content_hash
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        Index("idx_user_content_hash", "user_id", "content_hash"),
+    )
+    
     bill = relationship("Bill", back_populates="images")
+    ocr_jobs = relationship("OcrJob", back_populates="image", cascade="all, delete-orphan")
+
+class ImageBlob(Base):
+    __tablename__ = "image_blobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), unique=True, nullable=False)  # 文件内容SHA-256
+    file_path = Column(String(500), nullable=False)
+    file_size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)  # 引用该文件的 BillImage 数量
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class OcrJob(Base):
+    __tablename__ = "ocr_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey("bill_images.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    auto_create_bill = Column(Boolean, default=True, nullable=False)
+    status = Column(String(20), default="queued", nullable=False, index=True)  # queued/running/done/failed
+    attempts = Column(Integer, default=0, nullable=False)
+    error = Column(Text)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    image = relationship("BillImage", back_populates="ocr_jobs")
+
+class ReparseJob(Base):
+    __tablename__ = "reparse_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    # 筛选条件；user_id 为空表示所有用户（仅命令行可用）
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    date_from = Column(Date)  # 按图片上传日期筛选
+    date_to = Column(Date)
+    parse_status = Column(String(20))
+    source_type = Column(String(20))
+    ocr_mode = Column(String(10), default="auto", nullable=False)  # auto: 已保存的OCR文本有效时只重新解析文本；always: 总是重新OCR
+    auto_create_bill = Column(Boolean, default=False, nullable=False)  # 解析成功且未关联账单的图片是否创建账单
+    # 进度
+    status = Column(String(20), default="queued", nullable=False, index=True)  # queued/running/done/failed/cancelled
+    cursor_id = Column(Integer, default=0, nullable=False)  # 已处理到的图片ID（按ID递增分页，中断后从这里继续）
+    total = Column(Integer, default=0, nullable=False)
+    processed = Column(Integer, default=0, nullable=False)
+    skipped = Column(Integer, default=0, nullable=False)  # OCR与解析规则版本均未变化、无需处理的数量
+    text_only = Column(Integer, default=0, nullable=False)  # 复用已保存OCR文本的数量
+    reocr = Column(Integer, default=0, nullable=False)  # 重新OCR（含命中OCR缓存）的数量
+    succeeded = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    elapsed_seconds = Column(Float, default=0, nullable=False)  # 累计运行时间，用于计算吞吐量
+    error = Column(Text)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,465 @@
+"""
+OCR后台任务队列
+上传接口只负责保存文件并写入 ocr_jobs 表，由本模块的调度线程领取任务，
+未命中OCR缓存的图片交给OCR进程池识别，完成后回写 BillImage 的 ocr_result/parse_status。
+
+可以随API进程一起启动（OCR_EMBEDDED_WORKER=True），也可以单独运行:
+    python ocr_worker.py
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+import rollup  # noqa: F401  注册账单按月汇总事件（自动创建账单时同步更新汇总表）
+from config import settings
+from database import SessionLocal
+from models import Bill, BillImage, OcrJob
+from request_metrics import span
+from utils.ocr_lines import encode_ocr_lines
+from utils.ocr_parser import (
+    extract_text_from_images,
+    extract_text_timed,
+    get_ocr_engine,
+    ocr_cache,
+    ocr_cache_key,
+    ocr_version,
+    parse_bill_texts,
+    warm_up_ocr
+)
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _init_ocr_process():
+    """进程池初始化：在每个工作进程中加载 PaddleOCR（每个进程各持有一个实例）"""
+    get_ocr_engine()
+
+def get_ocr_executor() -> ProcessPoolExecutor:
+    """获取OCR进程池（进程内共享，首次使用时创建）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # PaddleOCR 不适合在 fork 出来的子进程中复用父进程状态，统一使用 spawn
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, settings.OCR_WORKER_PROCESSES),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_ocr_process
+            )
+        return _executor
+
+def reset_ocr_executor(broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """进程池损坏（工作进程崩溃）时重建"""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            logger.error("OCR进程池已损坏，重新创建")
+            broken.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+    return get_ocr_executor()
+
+def preload_ocr_workers():
+    """预先启动OCR进程池并预热模型（OCR_PRELOAD=True 时在启动阶段调用），不等待完成"""
+    executor = get_ocr_executor()
+    for _ in range(max(1, settings.OCR_WORKER_PROCESSES)):
+        executor.submit(warm_up_ocr)
+
+async def extract_text_async(file_path: str, content_hash: Optional[str] = None,
+                             bill_type: Optional[str] = None) -> Tuple[list, dict, str]:
+    """
+    在OCR进程池中识别单张图片（优先使用缓存），返回 (文本列表, 各阶段耗时, 文本对应的OCR版本)
+    API进程本身不加载 PaddleOCR 模型
+    - bill_type: 已知的账单类型提示，预处理时只保留该类账单的字段区域；
+      未使用提示的整图识别结果同样可用，也会先查缓存，命中时返回整图识别的版本（OCR_VERSION）
+    """
+    start = time.perf_counter()
+    key = ocr_cache_key(file_path, content_hash, bill_type)
+    lookups = [(key, bill_type)]
+    if bill_type is not None:
+        lookups.append((ocr_cache_key(file_path, content_hash), None))
+    for lookup_key, hint in lookups:
+        texts = ocr_cache.get(lookup_key)
+        if texts is not None:
+            return texts, {"cache": round((time.perf_counter() - start) * 1000, 2)}, ocr_version(hint)
+
+    loop = asyncio.get_running_loop()
+    executor = get_ocr_executor()
+    try:
+        with span("ocr"):
+            texts, timings = await loop.run_in_executor(executor, extract_text_timed, file_path, bill_type)
+    except BrokenProcessPool:
+        reset_ocr_executor(executor)
+        raise
+    ocr_cache.put(key, texts)
+    return texts, timings, ocr_version(bill_type)
+
+async def extract_texts_batch_async(images: List[Tuple[str, Optional[str]]]) -> list:
+    """
+    批量识别多张图片：先查OCR缓存，未命中的按进程数切分成若干组，
+    每组在一个工作进程内批量OCR（extract_text_from_images），批量耗时取决于进程数而不是图片数
+    - images: (文件路径, 内容SHA-256) 列表
+    返回列表与 images 一一对应，元素为 (文本列表, 各阶段耗时) 或 Exception
+    """
+    cache_keys = [ocr_cache_key(file_path, content_hash) for file_path, content_hash in images]
+    outputs: list = []  # None 表示待识别
+    for key in cache_keys:
+        start = time.perf_counter()
+        texts = ocr_cache.get(key)
+        outputs.append(None if texts is None else (texts, {"cache": round((time.perf_counter() - start) * 1000, 2)}))
+    pending = [index for index, output in enumerate(outputs) if output is None]
+    if not pending:
+        return outputs
+
+    chunk_count = min(len(pending), max(1, settings.OCR_WORKER_PROCESSES))
+    chunk_size = -(-len(pending) // chunk_count)
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+    # gather 保证结果顺序与提交顺序一致
+    loop = asyncio.get_running_loop()
+    executor = get_ocr_executor()
+    with span("ocr"):
+        chunk_outputs = await asyncio.gather(
+            *(loop.run_in_executor(executor, extract_text_from_images, [images[i][0] for i in chunk]) for chunk in chunks),
+            return_exceptions=True
+        )
+
+    for chunk, output in zip(chunks, chunk_outputs):
+        if isinstance(output, BaseException):
+            if isinstance(output, BrokenProcessPool):
+                reset_ocr_executor(executor)
+            output = [output] * len(chunk)
+        for index, item in zip(chunk, output):
+            outputs[index] = item
+            if isinstance(item, tuple):
+                ocr_cache.put(cache_keys[index], item[0])
+    return outputs
+
+def shutdown_ocr_executor():
+    """关闭OCR进程池"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+# 单独保存、不写入 ocr_result 的字段
+RAW_OCR_KEYS = ("raw_texts", "ocr_results", "ocr_version", "parser_version")
+
+def build_bill_from_parsed(user_id: int, parsed: dict) -> Bill:
+    """根据OCR解析出的字段构建账单对象"""
+    return Bill(
+        user_id=user_id,
+        title=parsed.get("merchant") or f"账单-{datetime.now().strftime('%Y%m%d')}",
+        amount=parsed.get("amount") or Decimal("0.00"),
+        category=parsed.get("category", "支出"),
+        type=parsed.get("type", "其他"),
+        description=parsed.get("description", ""),
+        bill_date=datetime.strptime(parsed.get("date"), "%Y-%m-%d").date() if parsed.get("date") else datetime.now().date()
+    )
+
+def apply_parse_result(
+    db: Session,
+    image: BillImage,
+    parse_result: dict,
+    auto_create_bill: bool
+) -> tuple[Optional[Bill], Optional[dict]]:
+    """
+    将解析结果写入图片记录，必要时创建账单（不提交事务）
+    OCR文本行与版本号单独保存（ocr_lines/ocr_model_version/parser_version），ocr_result 只保留解析结果；
+    本次没有OCR文本（识别失败）时保留已有的文本行
+    返回: (bill, parsed_data)
+    """
+    lines = parse_result.get("ocr_results")
+    if lines is not None:
+        image.ocr_lines = encode_ocr_lines(lines)
+        image.ocr_model_version = parse_result.get("ocr_version")
+    image.parser_version = parse_result.get("parser_version")
+    image.ocr_result = {key: value for key, value in parse_result.items() if key not in RAW_OCR_KEYS}
+    image.parse_status = "success" if parse_result.get("success") else "failed"
+    image.parse_error = parse_result.get("error")
+    image.source_type = parse_result.get("bill_type", "unknown")
+
+    bill = None
+    parsed_data = None
+
+    if parse_result.get("success") and auto_create_bill:
+        parsed_data = parse_result.get("parsed_data", {})
+        bill = build_bill_from_parsed(image.user_id, parsed_data)
+        db.add(bill)
+        db.flush()
+        image.bill_id = bill.id
+
+    return bill, parsed_data
+
+def enqueue_ocr_job(db: Session, image: BillImage, auto_create_bill: bool) -> OcrJob:
+    """为图片创建OCR任务（不提交事务）"""
+    image.parse_status = "pending"
+    image.parse_error = None
+    job = OcrJob(
+        image_id=image.id,
+        user_id=image.user_id,
+        auto_create_bill=auto_create_bill,
+        status="queued"
+    )
+    db.add(job)
+    db.flush()
+    return job
+
+class OcrJobDispatcher:
+    """
+    OCR任务调度器
+    - 调度线程从 ocr_jobs 表领取 queued 任务，提交到进程池
+    - 与批量同步上传共用 get_ocr_executor() 进程池，每个进程各自持有一个 PaddleOCR 实例
+    - 任务完成后由调度线程统一回写数据库
+    """
+
+    def __init__(self, processes: int, poll_interval: float):
+        self.processes = max(1, processes)
+        self.poll_interval = poll_interval
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._results: "queue.Queue[tuple[int, object, Optional[BaseException]]]" = queue.Queue()
+        self._inflight: set[int] = set()
+
+    def start(self):
+        """启动调度线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._requeue_stale_jobs()
+        self._thread = threading.Thread(target=self._run, name="ocr-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止调度，未完成的任务重新入队"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+        shutdown_ocr_executor()
+        if self._inflight:
+            self._reset_jobs(list(self._inflight))
+            self._inflight.clear()
+
+    def notify(self):
+        """有新任务入队时唤醒调度线程，避免等待轮询间隔"""
+        self._wakeup.set()
+
+    def _run(self):
+        last_recovery = datetime.utcnow()
+        while not self._stop.is_set():
+            try:
+                self._drain_results()
+                free_slots = self.processes * 2 - len(self._inflight)
+                if free_slots > 0:
+                    self._dispatch(free_slots)
+                if datetime.utcnow() - last_recovery > timedelta(seconds=settings.OCR_JOB_TIMEOUT):
+                    self._requeue_stale_jobs()
+                    last_recovery = datetime.utcnow()
+            except Exception:
+                logger.exception("OCR任务调度异常")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+        self._drain_results()
+
+    def _dispatch(self, limit: int):
+        """领取任务并提交到进程池"""
+        db = SessionLocal()
+        try:
+            candidates = db.query(OcrJob.id).filter(
+                OcrJob.status == "queued",
+                OcrJob.attempts < settings.OCR_JOB_MAX_ATTEMPTS
+            ).order_by(OcrJob.id).limit(limit).all()
+
+            for (job_id,) in candidates:
+                # 条件更新实现抢占，多个调度进程同时运行时也不会重复领取
+                claimed = db.query(OcrJob).filter(
+                    OcrJob.id == job_id,
+                    OcrJob.status == "queued",
+                    OcrJob.attempts < settings.OCR_JOB_MAX_ATTEMPTS
+                ).update({
+                    OcrJob.status: "running",
+                    OcrJob.attempts: OcrJob.attempts + 1,
+                    OcrJob.started_at: datetime.utcnow()
+                }, synchronize_session=False)
+                db.commit()
+                if not claimed:
+                    continue
+
+                image = db.query(BillImage).join(OcrJob, OcrJob.image_id == BillImage.id).filter(
+                    OcrJob.id == job_id
+                ).first()
+                if image is None:
+                    self._finish_job(db, job_id, "failed", "图片记录不存在")
+                    continue
+
+                self._submit(job_id, image.file_path, image.content_hash)
+        finally:
+            db.close()
+
+    def _submit(self, job_id: int, file_path: str, content_hash: Optional[str]):
+        """命中OCR缓存时直接完成，否则提交到进程池"""
+        self._inflight.add(job_id)
+        start = time.perf_counter()
+        try:
+            key = ocr_cache_key(file_path, content_hash)
+        except OSError as e:
+            self._results.put((job_id, None, None, e))
+            return
+
+        texts = ocr_cache.get(key)
+        if texts is not None:
+            timings = {"cache": round((time.perf_counter() - start) * 1000, 2)}
+            self._results.put((job_id, None, (texts, timings), None))
+            return
+
+        executor = get_ocr_executor()
+        try:
+            future = executor.submit(extract_text_timed, file_path)
+        except BrokenProcessPool:
+            future = reset_ocr_executor(executor).submit(extract_text_timed, file_path)
+
+        def _done(f, job_id=job_id, key=key):
+            if f.cancelled():
+                return
+            error = f.exception()
+            self._results.put((job_id, key, None if error else f.result(), error))
+            self._wakeup.set()
+
+        future.add_done_callback(_done)
+
+    def _drain_results(self):
+        """回写已完成任务的结果"""
+        while True:
+            try:
+                job_id, cache_key, output, error = self._results.get_nowait()
+            except queue.Empty:
+                return
+            self._inflight.discard(job_id)
+            if cache_key and error is None:
+                ocr_cache.put(cache_key, output[0])
+            db = SessionLocal()
+            try:
+                self._complete(db, job_id, output, error)
+            except Exception:
+                db.rollback()
+                logger.exception("回写OCR任务结果失败: job_id=%s", job_id)
+            finally:
+                db.close()
+
+    def _complete(self, db: Session, job_id: int, output: Optional[tuple], error: Optional[BaseException]):
+        """output 为 (文本列表, 各阶段耗时)"""
+        job = db.query(OcrJob).filter(OcrJob.id == job_id).first()
+        if job is None:
+            return  # 图片已被删除
+
+        if isinstance(error, BrokenProcessPool):
+            # 工作进程崩溃，未超过重试次数时重新入队
+            if job.attempts < settings.OCR_JOB_MAX_ATTEMPTS:
+                job.status = "queued"
+                job.error = str(error)
+                db.commit()
+                return
+            parse_result = {"success": False, "error": f"OCR任务失败: {error}", "bill_type": "unknown"}
+        elif error is not None:
+            parse_result = {"success": False, "error": str(error), "bill_type": "unknown"}
+        else:
+            texts, timings = output
+            parse_result = parse_bill_texts(texts, timings)
+
+        image = job.image
+        apply_parse_result(db, image, parse_result, job.auto_create_bill)
+        job.status = "failed" if isinstance(error, BrokenProcessPool) else "done"
+        job.error = parse_result.get("error")
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+    def _finish_job(self, db: Session, job_id: int, status: str, error: Optional[str]):
+        db.query(OcrJob).filter(OcrJob.id == job_id).update({
+            OcrJob.status: status,
+            OcrJob.error: error,
+            OcrJob.finished_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+
+    def _reset_jobs(self, job_ids: list[int]):
+        db = SessionLocal()
+        try:
+            db.query(OcrJob).filter(
+                OcrJob.id.in_(job_ids),
+                OcrJob.status == "running"
+            ).update({OcrJob.status: "queued"}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _requeue_stale_jobs(self):
+        """
+        将超时未完成的running任务重新入队（进程崩溃或重启后恢复）
+        已尝试 OCR_JOB_MAX_ATTEMPTS 次的任务（图片可能导致工作进程崩溃或卡死）不再入队，标记为失败
+        """
+        db = SessionLocal()
+        try:
+            deadline = datetime.utcnow() - timedelta(seconds=settings.OCR_JOB_TIMEOUT)
+            query = db.query(OcrJob).filter(
+                or_(
+                    and_(OcrJob.status == "running", OcrJob.started_at < deadline),
+                    # 停止时重置回 queued 的任务同样可能已用完重试次数，不会再被领取
+                    and_(OcrJob.status == "queued", OcrJob.attempts >= settings.OCR_JOB_MAX_ATTEMPTS)
+                )
+            )
+            if self._inflight:
+                query = query.filter(OcrJob.id.notin_(self._inflight))
+
+            requeued = failed = 0
+            for job in query.all():
+                if job.attempts < settings.OCR_JOB_MAX_ATTEMPTS:
+                    job.status = "queued"
+                    requeued += 1
+                    continue
+                error = f"OCR任务超时或工作进程异常，已尝试 {job.attempts} 次"
+                if job.image is not None:
+                    apply_parse_result(db, job.image, {"success": False, "error": error, "bill_type": "unknown"}, False)
+                job.status = "failed"
+                job.error = error
+                job.finished_at = datetime.utcnow()
+                failed += 1
+            db.commit()
+            if requeued:
+                logger.warning("重新入队 %d 个超时的OCR任务", requeued)
+            if failed:
+                logger.warning("%d 个OCR任务超过最大尝试次数，标记为失败", failed)
+        finally:
+            db.close()
+
+dispatcher = OcrJobDispatcher(
+    processes=settings.OCR_WORKER_PROCESSES,
+    poll_interval=settings.OCR_JOB_POLL_INTERVAL
+)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    dispatcher.start()
+    if settings.OCR_PRELOAD:
+        preload_ocr_workers()
+    logger.info("OCR worker 已启动，进程数: %d", dispatcher.processes)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.stop()
@@ -0,0 +1,327 @@
+"""
+批量重新解析
+升级解析规则或OCR模型后，按条件（用户、上传日期、解析状态、账单来源）筛选历史图片重新解析：
+- 按图片ID递增分页（keyset），每批处理完在同一事务内写入结果、进度和游标，中断后从游标继续
+- OCR版本与解析规则版本都未变化的图片直接跳过；只有解析规则变化时用已保存的OCR文本行重新解析；
+  OCR版本变化（或 ocr_mode=always）时交给OCR进程池批量识别
+
+命令行:
+    python reparse.py --user 1 --status failed --from 2024-01-01 --to 2024-06-30
+    python reparse.py --ocr-mode always
+    python reparse.py --resume 12
+"""
+import argparse
+import asyncio
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Query, Session, undefer
+
+from config import settings
+from database import SessionLocal
+from models import BillImage, ReparseJob
+from ocr_worker import apply_parse_result, extract_texts_batch_async, shutdown_ocr_executor
+from utils.field_extractor import PARSER_VERSION
+from utils.ocr_lines import decode_ocr_lines
+from utils.ocr_parser import OCR_VERSION, parse_bill_texts
+
+logger = logging.getLogger(__name__)
+
+# 可以（重新）开始运行的任务状态；running 状态超过 OCR_JOB_TIMEOUT 未更新也视为中断
+RESUMABLE_STATUSES = ("queued", "failed", "cancelled")
+
+def image_query(db: Session, job: ReparseJob) -> Query:
+    """按任务的筛选条件查询图片"""
+    query = db.query(BillImage)
+    if job.user_id is not None:
+        query = query.filter(BillImage.user_id == job.user_id)
+    if job.date_from:
+        query = query.filter(BillImage.created_at >= datetime.combine(job.date_from, datetime.min.time()))
+    if job.date_to:
+        query = query.filter(BillImage.created_at < datetime.combine(job.date_to + timedelta(days=1), datetime.min.time()))
+    if job.parse_status:
+        query = query.filter(BillImage.parse_status == job.parse_status)
+    if job.source_type:
+        query = query.filter(BillImage.source_type == job.source_type)
+    return query
+
+def create_reparse_job(
+    db: Session,
+    user_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    parse_status: Optional[str] = None,
+    source_type: Optional[str] = None,
+    ocr_mode: str = "auto",
+    auto_create_bill: bool = False
+) -> ReparseJob:
+    """创建批量重新解析任务并统计待处理数量（不提交事务）"""
+    job = ReparseJob(
+        user_id=user_id,
+        date_from=date_from,
+        date_to=date_to,
+        parse_status=parse_status,
+        source_type=source_type,
+        ocr_mode=ocr_mode,
+        auto_create_bill=auto_create_bill,
+        status="queued"
+    )
+    job.total = image_query(db, job).count()
+    db.add(job)
+    db.flush()
+    return job
+
+def claim_reparse_job(db: Session, job_id: int) -> bool:
+    """
+    将任务标记为 running（条件更新，多个进程同时领取时只有一个成功）
+    已完成或正在运行的任务返回 False
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.OCR_JOB_TIMEOUT)
+    claimed = db.query(ReparseJob).filter(
+        ReparseJob.id == job_id,
+        or_(
+            ReparseJob.status.in_(RESUMABLE_STATUSES),
+            and_(ReparseJob.status == "running", ReparseJob.updated_at < stale_before)
+        )
+    ).update({
+        ReparseJob.status: "running",
+        ReparseJob.error: None,
+        ReparseJob.finished_at: None,
+        ReparseJob.started_at: func.coalesce(ReparseJob.started_at, datetime.utcnow()),
+        ReparseJob.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+    db.commit()
+    return bool(claimed)
+
+def job_progress(job: ReparseJob) -> Dict:
+    """进度与吞吐量"""
+    rate = job.processed / job.elapsed_seconds if job.elapsed_seconds else 0.0
+    remaining = max(0, job.total - job.processed)
+    return {
+        "percent": round(job.processed * 100 / job.total, 2) if job.total else 100.0,
+        "images_per_second": round(rate, 2),
+        "eta_seconds": round(remaining / rate) if rate else None
+    }
+
+def _stored_texts(image: BillImage, ocr_mode: str) -> Optional[List[Dict]]:
+    """已保存且仍然有效的OCR文本行，无效时返回 None"""
+    if ocr_mode != "auto" or image.ocr_model_version != OCR_VERSION:
+        return None
+    return decode_ocr_lines(image.ocr_lines)
+
+def _is_current(image: BillImage, job: ReparseJob) -> bool:
+    """OCR和解析规则都是当前版本，重新解析的结果不会变化"""
+    if job.ocr_mode != "auto" or image.ocr_lines is None:
+        return False
+    if job.auto_create_bill and image.parse_status == "success" and not image.bill_id:
+        return False  # 还需要创建账单
+    return image.ocr_model_version == OCR_VERSION and image.parser_version == PARSER_VERSION
+
+def process_chunk(db: Session, job: ReparseJob, images: List[BillImage]):
+    """重新解析一批图片并更新任务进度（不提交事务）"""
+    job.processed += len(images)
+    job.cursor_id = images[-1].id
+
+    pending = [image for image in images if not _is_current(image, job)]
+    job.skipped += len(images) - len(pending)
+    images = pending
+
+    stored = [_stored_texts(image, job.ocr_mode) for image in images]
+    need_ocr = [index for index, texts in enumerate(stored) if texts is None]
+
+    outputs: Dict[int, object] = {}
+    if need_ocr:
+        ocr_outputs = asyncio.run(extract_texts_batch_async(
+            [(images[index].file_path, images[index].content_hash) for index in need_ocr]
+        ))
+        outputs = dict(zip(need_ocr, ocr_outputs))
+
+    for index, image in enumerate(images):
+        if stored[index] is not None:
+            parse_result = parse_bill_texts(stored[index], {})
+            job.text_only += 1
+        else:
+            output = outputs[index]
+            if isinstance(output, BaseException):
+                parse_result = {"success": False, "error": str(output), "bill_type": "unknown"}
+            else:
+                parse_result = parse_bill_texts(*output)
+            job.reocr += 1
+
+        # 已关联账单的图片不再重复创建账单
+        apply_parse_result(db, image, parse_result, job.auto_create_bill and not image.bill_id)
+        if image.parse_status == "success":
+            job.succeeded += 1
+        else:
+            job.failed += 1
+
+def run_reparse_job(
+    job_id: int,
+    chunk_size: Optional[int] = None,
+    stop: Optional[threading.Event] = None,
+    on_progress: Optional[Callable[[ReparseJob], None]] = None
+) -> Optional[str]:
+    """
+    运行已领取（running）的任务直到完成、被取消或 stop 被设置，返回任务最终状态
+    每批图片的结果与进度在同一事务内提交
+    """
+    chunk_size = chunk_size or settings.REPARSE_CHUNK_SIZE
+    while True:
+        db = SessionLocal()
+        try:
+            job = db.query(ReparseJob).filter(ReparseJob.id == job_id).first()
+            if job is None or job.status != "running":
+                return job.status if job else None  # 已被取消
+
+            if stop is not None and stop.is_set():
+                job.status = "queued"  # 进程退出，保留游标等待继续
+                db.commit()
+                return job.status
+
+            images = image_query(db, job).options(undefer(BillImage.ocr_lines)).filter(
+                BillImage.id > job.cursor_id
+            ).order_by(BillImage.id).limit(chunk_size).all()
+
+            if not images:
+                job.status = "done"
+                job.finished_at = datetime.utcnow()
+                db.commit()
+                return job.status
+
+            start = time.perf_counter()
+            process_chunk(db, job, images)
+            job.elapsed_seconds += time.perf_counter() - start
+            db.commit()
+
+            if on_progress is not None:
+                on_progress(job)
+        except Exception as e:
+            db.rollback()
+            logger.exception("批量重新解析失败: job_id=%s", job_id)
+            db.query(ReparseJob).filter(ReparseJob.id == job_id).update({
+                ReparseJob.status: "failed",
+                ReparseJob.error: str(e)
+            }, synchronize_session=False)
+            db.commit()
+            return "failed"
+        finally:
+            db.close()
+
+# API进程内运行的任务线程
+_threads: Dict[int, threading.Thread] = {}
+_threads_lock = threading.Lock()
+_stop = threading.Event()
+
+def start_reparse_job(job_id: int) -> bool:
+    """领取任务并在后台线程中运行，任务不可运行（已完成或正在运行）时返回 False"""
+    db = SessionLocal()
+    try:
+        if not claim_reparse_job(db, job_id):
+            return False
+    finally:
+        db.close()
+
+    thread = threading.Thread(target=run_reparse_job, args=(job_id,), kwargs={"stop": _stop},
+                              name=f"reparse-{job_id}", daemon=True)
+    with _threads_lock:
+        for finished in [key for key, value in _threads.items() if not value.is_alive()]:
+            del _threads[finished]
+        _threads[job_id] = thread
+    thread.start()
+    return True
+
+def resume_reparse_jobs():
+    """继续上次进程退出时中断的任务（queued 和超时未更新的 running）"""
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.OCR_JOB_TIMEOUT)
+    db = SessionLocal()
+    try:
+        job_ids = [job_id for (job_id,) in db.query(ReparseJob.id).filter(or_(
+            ReparseJob.status == "queued",
+            and_(ReparseJob.status == "running", ReparseJob.updated_at < stale_before)
+        ))]
+    finally:
+        db.close()
+    for job_id in job_ids:
+        start_reparse_job(job_id)
+
+def stop_reparse_jobs(timeout: float = 10.0):
+    """通知后台任务在当前批次完成后停止（任务回到 queued，可继续）"""
+    _stop.set()
+    with _threads_lock:
+        threads = list(_threads.values())
+    for thread in threads:
+        thread.join(timeout)
+
+def _print_progress(job: ReparseJob):
+    progress = job_progress(job)
+    eta = f"{progress['eta_seconds']}s" if progress["eta_seconds"] is not None else "-"
+    print(
+        f"[{job.id}] {job.processed}/{job.total} ({progress['percent']}%) "
+        f"成功 {job.succeeded} 失败 {job.failed} 跳过 {job.skipped} 复用文本 {job.text_only} 重新OCR {job.reocr} "
+        f"{progress['images_per_second']} 张/秒 剩余 {eta}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="批量重新解析账单图片")
+    parser.add_argument("--resume", type=int, help="继续已有任务（任务ID）")
+    parser.add_argument("--user", type=int, help="只处理该用户的图片")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="上传日期起（YYYY-MM-DD）")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="上传日期止（YYYY-MM-DD）")
+    parser.add_argument("--status", choices=["pending", "success", "failed"], help="解析状态")
+    parser.add_argument("--source", help="账单来源（alipay/wechat/unknown）")
+    parser.add_argument("--ocr-mode", choices=["auto", "always"], default="auto",
+                        help="auto: OCR文本有效时只重新解析文本；always: 总是重新OCR")
+    parser.add_argument("--create-bills", action="store_true", help="解析成功且未关联账单时创建账单")
+    parser.add_argument("--chunk-size", type=int, help=f"每批处理的图片数（默认 {settings.REPARSE_CHUNK_SIZE}）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    db = SessionLocal()
+    try:
+        if args.resume:
+            job_id = args.resume
+        else:
+            job = create_reparse_job(
+                db,
+                user_id=args.user,
+                date_from=args.date_from,
+                date_to=args.date_to,
+                parse_status=args.status,
+                source_type=args.source,
+                ocr_mode=args.ocr_mode,
+                auto_create_bill=args.create_bills
+            )
+            db.commit()
+            job_id = job.id
+            print(f"创建任务 {job_id}，共 {job.total} 张图片")
+        if not claim_reparse_job(db, job_id):
+            print(f"任务 {job_id} 不存在、已完成或正在运行")
+            return
+    finally:
+        db.close()
+
+    try:
+        status = run_reparse_job(job_id, args.chunk_size, on_progress=_print_progress)
+    except KeyboardInterrupt:
+        # 当前批次未提交，游标停留在上一批，之后可继续
+        db = SessionLocal()
+        try:
+            db.query(ReparseJob).filter(ReparseJob.id == job_id, ReparseJob.status == "running").update(
+                {ReparseJob.status: "queued"}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+        print(f"已中断，使用 --resume {job_id} 继续")
+        return
+    finally:
+        shutdown_ocr_executor()
+    print(f"任务 {job_id} 结束: {status}")
+
+if __name__ == "__main__":
+    main()
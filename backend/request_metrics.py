@@ -0,0 +1,269 @@
+"""
+请求耗时统计（Prometheus 文本格式，GET /metrics）
+RequestMetricsMiddleware 按路由模板（如 /api/bills/{bill_id}，没有匹配路由的请求记为 unmatched）记录
+请求数（按状态码）、耗时直方图和正在处理的请求数，以及每个请求内各阶段的耗时：
+- dependencies: 进入路由到接口函数开始执行（认证、读取和解析请求体/上传文件）
+- db: 执行SQL（包括 run_sync 和线程池中的同步查询）
+- ocr: 等待OCR进程池
+- storage: 上传文件写入临时文件并计算摘要
+- serialize: 接口函数返回到开始发送响应（响应模型校验和JSON编码）
+阶段耗时通过 contextvars 记在当前请求上，后台任务和OCR调度线程中的查询不计入；统计只包含当前进程
+"""
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+UNMATCHED_ROUTE = "unmatched"
+
+# 连接池指标中累计值（counter）与其他当前值（gauge）的区分
+POOL_COUNTERS = ("checkouts", "timeouts", "pre_pings", "pre_ping_failures")
+
+class RequestTiming:
+    """一个请求的路由模板和各阶段累计耗时（秒）"""
+    __slots__ = ("route", "route_started", "handler_finished", "spans")
+
+    def __init__(self):
+        self.route: Optional[str] = None
+        self.route_started: Optional[float] = None
+        self.handler_finished: Optional[float] = None
+        self.spans: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+_current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+def add_span(name: str, seconds: float):
+    """把耗时计入当前请求的 name 阶段（不在请求中时忽略）"""
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+@contextmanager
+def span(name: str):
+    """with span("ocr"): ... 代码块的耗时计入当前请求的 name 阶段"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - start)
+
+class Histogram:
+    """固定分桶的直方图（各桶分别计数，输出时累加为 Prometheus 的 le 桶）"""
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self) -> "Histogram":
+        other = Histogram()
+        other.buckets, other.sum, other.count = list(self.buckets), self.sum, self.count
+        return other
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _render_histogram(lines: List[str], name: str, labels: Dict[str, str], histogram: Histogram):
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.buckets):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+class RequestMetrics:
+    """按 (请求方法, 路由模板) 汇总的请求统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+        self._latency: Dict[Tuple[str, str], Histogram] = {}
+        self._spans: Dict[Tuple[str, str, str], Histogram] = {}
+        self._in_flight: Dict[Tuple[str, str], int] = {}
+
+    def enter(self, method: str, route: str):
+        with self._lock:
+            self._in_flight[method, route] = self._in_flight.get((method, route), 0) + 1
+
+    def leave(self, method: str, route: str):
+        with self._lock:
+            self._in_flight[method, route] -= 1
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, spans: Dict[str, float]):
+        with self._lock:
+            key = (method, route, status_code)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._latency.setdefault((method, route), Histogram()).observe(seconds)
+            for name, value in spans.items():
+                self._spans.setdefault((method, route, name), Histogram()).observe(value)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            requests = sorted(self._requests.items())
+            in_flight = sorted(self._in_flight.items())
+            latency = sorted((key, histogram.copy()) for key, histogram in self._latency.items())
+            spans = sorted((key, histogram.copy()) for key, histogram in self._spans.items())
+
+        lines = [
+            "# HELP http_requests_total 请求数（按路由模板和状态码，5xx 即出错的请求）",
+            "# TYPE http_requests_total counter",
+        ]
+        lines += [
+            f"http_requests_total{_labels(method=method, route=route, status=status)} {count}"
+            for (method, route, status), count in requests
+        ]
+        lines += ["# HELP http_requests_in_flight 正在处理的请求数", "# TYPE http_requests_in_flight gauge"]
+        lines += [
+            f"http_requests_in_flight{_labels(method=method, route=route)} {count}"
+            for (method, route), count in in_flight
+        ]
+        lines += ["# HELP http_request_duration_seconds 请求耗时（到响应发送完毕）", "# TYPE http_request_duration_seconds histogram"]
+        for (method, route), histogram in latency:
+            _render_histogram(lines, "http_request_duration_seconds", {"method": method, "route": route}, histogram)
+        lines += [
+            "# HELP http_request_span_seconds 单个请求内各阶段的累计耗时（dependencies/db/ocr/storage/serialize）",
+            "# TYPE http_request_span_seconds histogram",
+        ]
+        for (method, route, name), histogram in spans:
+            _render_histogram(
+                lines, "http_request_span_seconds", {"method": method, "route": route, "span": name}, histogram
+            )
+        return lines
+
+request_metrics = RequestMetrics()
+
+def render_pool_metrics(metrics: Dict) -> List[str]:
+    """database.pool_metrics() 的数值项转为 db_pool_* 指标"""
+    lines = []
+    for pool in ("sync", "async"):
+        for field, value in metrics[pool].items():
+            name = "db_pool_" + field.removeprefix("pool_")
+            if field in POOL_COUNTERS:
+                lines.append(f"# TYPE {name}_total counter")
+                lines.append(f"{name}_total{_labels(pool=pool)} {value}")
+            else:
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{_labels(pool=pool)} {value}")
+    return lines
+
+class RequestMetricsMiddleware:
+    """记录每个请求的状态码和耗时（纯ASGI中间件，流式响应的耗时计到最后一块发送完毕）"""
+
+    def __init__(self, app, metrics: RequestMetrics = request_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current_timing.set(timing)
+        start = time.perf_counter()
+        status_code = 500  # 未处理的异常由外层返回500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if timing.handler_finished is not None:
+                    timing.add("serialize", time.perf_counter() - timing.handler_finished)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_timing.reset(token)
+            self.metrics.observe(
+                scope["method"], timing.route or UNMATCHED_ROUTE, status_code, time.perf_counter() - start, timing.spans
+            )
+
+def _handler_started():
+    timing = _current_timing.get()
+    if timing is not None and timing.route_started is not None:
+        timing.add("dependencies", time.perf_counter() - timing.route_started)
+
+def _handler_finished():
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.handler_finished = time.perf_counter()
+
+def _timed_endpoint(endpoint):
+    """包装接口函数，记录开始执行和返回的时间（保留签名，FastAPI 仍按原函数解析参数）"""
+    if getattr(endpoint, "_timed", False):
+        return endpoint
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            _handler_started()
+            result = await endpoint(*args, **kwargs)
+            _handler_finished()
+            return result
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            _handler_started()
+            result = endpoint(*args, **kwargs)
+            _handler_finished()
+            return result
+    wrapper._timed = True
+    return wrapper
+
+class TimedRoute(APIRoute):
+    """记录请求匹配到的路由模板和正在处理的请求数（APIRouter 的 route_class）"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    async def handle(self, scope, receive, send):
+        timing = _current_timing.get()
+        if timing is None:
+            await super().handle(scope, receive, send)
+            return
+        timing.route = self.path
+        timing.route_started = time.perf_counter()
+        request_metrics.enter(scope["method"], self.path)
+        try:
+            await super().handle(scope, receive, send)
+        finally:
+            request_metrics.leave(scope["method"], self.path)
+
+def instrument_engine(engine: Engine):
+    """SQL执行耗时计入当前请求的 db 阶段"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and _current_timing.get() is not None:
+            context._request_query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_request_query_started", None)
+        if started is not None:
+            add_span("db", time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _query_failed(exception_context):
+        started = getattr(exception_context.execution_context, "_request_query_started", None)
+        if started is not None:
+            add_span("db", time.perf_counter() - started)
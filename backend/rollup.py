@@ -0,0 +1,361 @@
+"""
+账单按月汇总表（bill_monthly_rollups）的维护与查询
+每个 (用户, 月份, 收支分类, 消费类型) 一行，记录金额合计和账单数。
+账单通过ORM新增、修改、删除时（包括OCR解析自动创建账单、随用户级联删除），
+由映射事件在同一个事务内累加差值；统计查询的整月部分读汇总表，首尾不完整的月份读账单表。
+
+汇总表由本次API启动新建时（升级后首次启动）按账单表回填；设置 ROLLUP_VERIFY_ON_STARTUP 时每次启动
+比对两表的收入、支出合计和账单数（需要扫描账单表），不一致时重建。
+直接用SQL写入账单后运行 python rollup.py 重建（--check 只在不一致时重建）。
+"""
+import argparse
+import calendar
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Date, and_, bindparam, case, delete, event, func, inspect, literal, select, union_all
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from models import Bill, BillMonthlyRollup
+
+logger = logging.getLogger(__name__)
+
+RollupKey = Tuple[int, date, str, str]  # (user_id, month, category, type)
+
+# 参与汇总的账单字段，修改任一字段都要从旧的汇总行移到新的汇总行
+ROLLUP_FIELDS = ("user_id", "bill_date", "category", "type", "amount")
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def rollup_key(user_id: int, bill_date: date, category: str, bill_type: str) -> RollupKey:
+    return (user_id, month_start(bill_date), category, bill_type)
+
+def _upsert_statement(connection: Connection):
+    """按方言生成“插入或累加”语句（参数在执行时传入，可一次 executemany 多行），并发写入同一汇总行时由数据库保证原子性"""
+    table = BillMonthlyRollup.__table__
+    dialect = connection.dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        return stmt.on_duplicate_key_update(
+            total_amount=table.c.total_amount + stmt.inserted.total_amount,
+            bill_count=table.c.bill_count + stmt.inserted.bill_count
+        )
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=["user_id", "month", "category", "type"],
+            set_={
+                "total_amount": table.c.total_amount + stmt.excluded.total_amount,
+                "bill_count": table.c.bill_count + stmt.excluded.bill_count,
+            }
+        )
+    return None
+
+def _key_match(user_id, month, category, bill_type):
+    table = BillMonthlyRollup.__table__
+    return and_(
+        table.c.user_id == user_id,
+        table.c.month == month,
+        table.c.category == category,
+        table.c.type == bill_type
+    )
+
+def apply_rollup_deltas(connection: Connection, deltas: Dict[RollupKey, Tuple[Decimal, int]]):
+    """把每个汇总行的差值累加上去（不存在时创建），支持的方言用一条 executemany 写入全部汇总行；账单数归零的行删除"""
+    if not deltas:
+        return
+    table = BillMonthlyRollup.__table__
+    params = [
+        {"user_id": user_id, "month": month, "category": category, "type": bill_type,
+         "total_amount": amount, "bill_count": count}
+        for (user_id, month, category, bill_type), (amount, count) in deltas.items()
+    ]
+
+    upsert = _upsert_statement(connection)
+    if upsert is not None:
+        connection.execute(upsert, params)
+    else:
+        for values in params:
+            updated = connection.execute(
+                table.update().where(_key_match(values["user_id"], values["month"], values["category"], values["type"])).values(
+                    total_amount=table.c.total_amount + values["total_amount"],
+                    bill_count=table.c.bill_count + values["bill_count"]
+                )
+            ).rowcount
+            if not updated:
+                connection.execute(table.insert().values(**values))
+
+    removed = [values for values in params if values["bill_count"] < 0]
+    if removed:
+        connection.execute(
+            table.delete().where(
+                _key_match(bindparam("user_id"), bindparam("month"), bindparam("category"), bindparam("type")),
+                table.c.bill_count <= 0
+            ),
+            [{key: values[key] for key in ("user_id", "month", "category", "type")} for values in removed]
+        )
+
+def apply_rollup_delta(connection: Connection, key: RollupKey, amount: Decimal, count: int):
+    """把一个差值累加到汇总行（不存在时创建），账单数归零的行删除"""
+    apply_rollup_deltas(connection, {key: (amount, count)})
+
+def apply_rollup_rows(connection: Connection, rows: Iterable[Dict], sign: int = 1):
+    """
+    绕过ORM批量写入/删除账单时调用：rows 为账单字段字典，sign 为 1（新增）或 -1（删除）
+    同一汇总行的差值先合并，所有汇总行一次写入
+    """
+    deltas: Dict[RollupKey, list] = defaultdict(lambda: [Decimal("0"), 0])
+    for row in rows:
+        delta = deltas[rollup_key(row["user_id"], row["bill_date"], row["category"], row["type"])]
+        delta[0] += Decimal(row["amount"]) * sign
+        delta[1] += sign
+    apply_rollup_deltas(connection, {key: tuple(delta) for key, delta in deltas.items()})
+
+def _current_values(target: Bill) -> Tuple[RollupKey, Decimal]:
+    return rollup_key(target.user_id, target.bill_date, target.category, target.type), Decimal(target.amount)
+
+@event.listens_for(Bill, "after_insert")
+def _rollup_insert(mapper, connection, target: Bill):
+    key, amount = _current_values(target)
+    apply_rollup_delta(connection, key, amount, 1)
+
+@event.listens_for(Bill, "before_delete")
+def _rollup_delete(mapper, connection, target: Bill):
+    # 在删除语句之前读取字段：对象已过期时还能从数据库加载
+    key, amount = _current_values(target)
+    apply_rollup_delta(connection, key, -amount, -1)
+
+@event.listens_for(Bill, "after_update")
+def _rollup_update(mapper, connection, target: Bill):
+    state = inspect(target)
+    old = {}
+    for field in ROLLUP_FIELDS:
+        history = state.attrs[field].history
+        if history.deleted:
+            old[field] = history.deleted[0]
+    if not old:
+        return
+
+    values = {field: old.get(field, getattr(target, field)) for field in ROLLUP_FIELDS}
+    old_key = rollup_key(values["user_id"], values["bill_date"], values["category"], values["type"])
+    new_key, new_amount = _current_values(target)
+    old_amount = Decimal(values["amount"])
+    if old_key == new_key:
+        if new_amount != old_amount:
+            apply_rollup_delta(connection, new_key, new_amount - old_amount, 0)
+        return
+    apply_rollup_delta(connection, old_key, -old_amount, -1)
+    apply_rollup_delta(connection, new_key, new_amount, 1)
+
+# 修改这些字段时先加载旧值（对象已过期时默认不加载），after_update 才能拿到旧的汇总行
+for _field in ROLLUP_FIELDS:
+    event.listen(getattr(Bill, _field), "set", lambda target, value, oldvalue, initiator: None, active_history=True)
+
+def _bill_totals(filters, group=()) -> Select:
+    return select(
+        func.sum(case((Bill.category == "收入", Bill.amount))),
+        func.sum(case((Bill.category == "支出", Bill.amount))),
+        func.count(),
+        *group
+    ).select_from(Bill).where(*filters).group_by(*group)
+
+def _rollup_totals(filters, group=()) -> Select:
+    rollups = BillMonthlyRollup
+    return select(
+        func.sum(case((rollups.category == "收入", rollups.total_amount))),
+        func.sum(case((rollups.category == "支出", rollups.total_amount))),
+        func.sum(rollups.bill_count),
+        *group
+    ).where(*filters).group_by(*group)
+
+class MonthSplit(NamedTuple):
+    """统计日期范围的拆分：[full_from, full_to) 内的整月读汇总表，edges 中的日期范围（含两端，各在一个月内）读账单表"""
+    use_rollup: bool
+    full_from: Optional[date]
+    full_to: Optional[date]
+    edges: List[Tuple[date, date]]
+
+def split_months(start_date: Optional[date], end_date: Optional[date]) -> MonthSplit:
+    full_from = None
+    if start_date:
+        full_from = start_date if start_date.day == 1 else next_month(start_date)
+    full_to = None
+    if end_date:
+        last_day = calendar.monthrange(end_date.year, end_date.month)[1]
+        full_to = next_month(end_date) if end_date.day == last_day else month_start(end_date)
+
+    if full_from and full_to and full_from >= full_to:
+        # 范围不包含完整的月份（在一个月内或跨相邻两个月），按月拆开读账单表
+        edges = []
+        day = start_date
+        while day <= end_date:
+            edges.append((day, min(end_date, next_month(day) - timedelta(days=1))))
+            day = next_month(day)
+        return MonthSplit(False, None, None, edges)
+
+    edges = []
+    if start_date and start_date < full_from:
+        edges.append((start_date, full_from - timedelta(days=1)))
+    if end_date and full_to <= end_date:
+        edges.append((full_to, end_date))
+    return MonthSplit(True, full_from, full_to, edges)
+
+# 分组统计支持的维度：账单表的分组列、汇总表的分组列
+GROUP_COLUMNS = {
+    "type": (Bill.type, BillMonthlyRollup.type),
+    "category": (Bill.category, BillMonthlyRollup.category),
+}
+
+def grouped_statement(user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                      by: Optional[str] = None):
+    """
+    统计 [start_date, end_date] 内的收入、支出和账单数，by 为 None / type / category / month
+    返回若干行 (收入, 支出, 数量[, 分组值])，同一分组可能出现多行，由 merge_totals 合并
+    完整覆盖的月份读汇总表，首尾不完整的月份读账单表（各自一个连续日期范围，都走索引范围扫描），
+    各部分 UNION ALL 后一次查询返回
+    """
+    split = split_months(start_date, end_date)
+    parts = []
+
+    if split.use_rollup:
+        rollup_filters = [BillMonthlyRollup.user_id == user_id]
+        if split.full_from:
+            rollup_filters.append(BillMonthlyRollup.month >= split.full_from)
+        if split.full_to:
+            rollup_filters.append(BillMonthlyRollup.month < split.full_to)
+        if by == "month":
+            group = (BillMonthlyRollup.month,)
+        else:
+            group = (GROUP_COLUMNS[by][1],) if by else ()
+        parts.append(_rollup_totals(rollup_filters, group))
+
+    for edge_start, edge_end in split.edges:
+        filters = [Bill.user_id == user_id, Bill.bill_date >= edge_start, Bill.bill_date <= edge_end]
+        if by == "month":
+            # 每段都在一个月内，月份是常量
+            parts.append(_bill_totals(filters).add_columns(literal(month_start(edge_start), Date)))
+        else:
+            parts.append(_bill_totals(filters, (GROUP_COLUMNS[by][0],) if by else ()))
+
+    if not parts:
+        # 开始日期晚于结束日期
+        parts.append(_bill_totals([Bill.user_id == user_id, Bill.bill_date >= start_date, Bill.bill_date <= end_date]))
+    return parts[0] if len(parts) == 1 else union_all(*parts)
+
+def summary_statement(user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    """统计 [start_date, end_date] 内的收入、支出和账单数，返回若干行 (收入, 支出, 数量)，调用方求和"""
+    return grouped_statement(user_id, start_date, end_date)
+
+def merge_totals(rows, by: Optional[str] = None) -> Dict:
+    """
+    合并 grouped_statement / daily_statement 的结果，返回 {分组值: (收入, 支出, 数量)}，不分组时分组值为 None
+    """
+    totals: Dict = defaultdict(lambda: [Decimal("0"), Decimal("0"), 0])
+    for row in rows:
+        income, expense, count = row[:3]
+        if not count:
+            continue
+        total = totals[row[3] if by else None]
+        total[0] += income or Decimal("0")
+        total[1] += expense or Decimal("0")
+        total[2] += int(count)
+    return {key: tuple(value) for key, value in totals.items()}
+
+def daily_statement(user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None) -> Select:
+    """按天统计（只读覆盖索引，按日期顺序分组），按周统计在此基础上合并"""
+    filters = [Bill.user_id == user_id]
+    if start_date:
+        filters.append(Bill.bill_date >= start_date)
+    if end_date:
+        filters.append(Bill.bill_date <= end_date)
+    return _bill_totals(filters, (Bill.bill_date,)).order_by(Bill.bill_date)
+
+def rebuild_rollups(db: Session, user_id: Optional[int] = None) -> int:
+    """按账单表重新生成汇总行（不提交事务），返回生成的行数"""
+    rollups = BillMonthlyRollup.__table__
+    clear = delete(rollups)
+    if user_id is not None:
+        clear = clear.where(rollups.c.user_id == user_id)
+    db.execute(clear)
+
+    query = select(Bill.user_id, Bill.bill_date, Bill.category, Bill.type, Bill.amount)
+    if user_id is not None:
+        query = query.where(Bill.user_id == user_id)
+    totals: Dict[RollupKey, list] = defaultdict(lambda: [Decimal("0"), 0])
+    for row in db.execute(query.execution_options(yield_per=10000)):
+        total = totals[rollup_key(row.user_id, row.bill_date, row.category, row.type)]
+        total[0] += row.amount
+        total[1] += 1
+
+    rows = [
+        {"user_id": key[0], "month": key[1], "category": key[2], "type": key[3],
+         "total_amount": amount, "bill_count": count}
+        for key, (amount, count) in totals.items()
+    ]
+    for start in range(0, len(rows), 1000):
+        db.execute(rollups.insert(), rows[start:start + 1000])
+    return len(rows)
+
+def rollup_mismatch(db: Session) -> Optional[str]:
+    """比对账单表与汇总表的收入合计、支出合计和账单数（各扫描一遍），一致时返回 None，否则返回差异说明"""
+    bills = tuple(value or 0 for value in db.execute(_bill_totals(())).one())
+    rolled = tuple(value or 0 for value in db.execute(_rollup_totals(())).one())
+    if bills == rolled:
+        return None
+    return f"账单表 收入/支出/账单数 {bills}，汇总表 {rolled}"
+
+def ensure_rollups(db: Session, verify: bool = True) -> Optional[int]:
+    """
+    重建汇总表（并提交），返回生成的行数
+    - verify: 先比对两表，一致时不重建并返回 None；为 False 时直接重建（汇总表刚创建时）
+    多个进程同时启动时只有一个能重建成功，其余回滚后沿用已重建的结果
+    """
+    if verify:
+        mismatch = rollup_mismatch(db)
+        if mismatch is None:
+            return None
+        logger.warning("按月汇总表与账单表不一致，开始重建: %s", mismatch)
+    try:
+        count = rebuild_rollups(db)
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        logger.exception("重建按月汇总表失败（可能其他进程正在重建），可运行 python rollup.py 手动重建")
+        return None
+    logger.warning("按月汇总表重建完成，共 %d 行", count)
+    return count
+
+def main():
+    from database import Base, SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="重建账单按月汇总表")
+    parser.add_argument("--user", type=int, help="只重建该用户的汇总行")
+    parser.add_argument("--check", action="store_true", help="先比对账单表与汇总表，不一致时才重建（不能与 --user 同时使用）")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if args.check and args.user is None:
+            count = ensure_rollups(db)
+            print("汇总表与账单表一致" if count is None else f"已生成 {count} 行汇总数据")
+            return
+        count = rebuild_rollups(db, args.user)
+        db.commit()
+        print(f"已生成 {count} 行汇总数据")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
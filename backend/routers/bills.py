@@ -1,21 +1,41 @@
-from typing import List, Optional
-from datetime import date
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+import base64
+import csv
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from datetime import date, timedelta
+from fastapi import APIRouter, Body, Depends, File, HTTPException, status, Query, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from decimal import Decimal
-from database import get_db
-from auth import get_current_user
-from models import User, Bill
-from schemas import BillCreate, BillUpdate, BillResponse, BillStatistics
+from config import settings
+from database import AsyncSessionLocal, get_async_db
+from auth import CurrentUser, get_current_user
+from bill_export import MEDIA_TYPES, BillExportEncoder, export_filename, export_statement
+from bill_import import ImportReport, ImportRow, csv_rows, insert_chunk, json_rows, next_chunk
+from statement_import import StatementReader
+from models import Bill
+from request_metrics import TimedRoute
+from rollup import daily_statement, grouped_statement, merge_totals, summary_statement
+from schemas import (
+    BillCreate,
+    BillUpdate,
+    BillResponse,
+    BillStatistics,
+    BillSeriesPoint,
+    BillBreakdownItem,
+    BillImportCreate,
+    BillImportResult,
+    StatementImportResult
+)
 
-router = APIRouter(prefix="/api/bills", tags=["账单"])
+router = APIRouter(prefix="/api/bills", tags=["账单"], route_class=TimedRoute)
 
 @router.post("", response_model=BillResponse, status_code=status.HTTP_201_CREATED)
-def create_bill(
+async def create_bill(
     bill: BillCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建账单"""
     db_bill = Bill(
@@ -28,60 +48,195 @@ def create_bill(
         bill_date=bill.bill_date
     )
     db.add(db_bill)
-    db.commit()
-    db.refresh(db_bill)
+    await db.commit()
+    await db.refresh(db_bill)
     return db_bill
 
+async def import_bills(items: Iterator[ImportRow], user_id: int, db: AsyncSession,
+                       schema=BillCreate) -> BillImportResult:
+    """分批导入：读取和校验放在线程池，写入每批一条批量INSERT并提交"""
+    report = ImportReport()
+    while True:
+        rows = await run_in_threadpool(next_chunk, items, user_id, report, schema)
+        if rows is None:
+            break
+        if rows:
+            await db.run_sync(insert_chunk, rows, report)
+    return report.result()
+
+@router.post("/bulk", response_model=BillImportResult)
+async def create_bills_bulk(
+    bills: List[Dict[str, Any]] = Body(...),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    批量创建账单（每个元素与创建账单的请求体相同）
+    逐条校验，出错的账单不影响其他账单，返回成功数和出错的序号（从1开始）
+    """
+    if len(bills) > settings.BILL_BULK_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"单次最多提交 {settings.BILL_BULK_MAX_ROWS} 条账单，更多请使用CSV导入")
+    return await import_bills(json_rows(bills), current_user.id, db)
+
+@router.post("/import", response_model=BillImportResult)
+async def import_bills_csv(
+    file: UploadFile = File(...),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    从CSV导入账单（UTF-8编码，表头包含 title, amount, category, type, bill_date，description 可选，其他列忽略）
+    逐行读取、分批写入，出错的行不影响其他行，返回成功数和出错的行号
+    """
+    user_id = current_user.id
+    # 表头在开始写入前校验；之后读取出错时返回已导入的部分和 error
+    try:
+        items = await run_in_threadpool(csv_rows, file.file)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV文件需为UTF-8编码")
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await import_bills(items, user_id, db)
+
+@router.post("/import/statement", response_model=StatementImportResult)
+async def import_statement(
+    file: UploadFile = File(...),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    导入支付宝/微信导出的账单明细CSV（自动识别平台和编码）
+    收支分类、消费类型与截图OCR解析使用相同的规则；交易单号已导入过的交易跳过，可以重复导入有重叠的明细
+    """
+    user_id = current_user.id
+    try:
+        reader = await run_in_threadpool(StatementReader, file.file)
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = await import_bills(iter(reader), user_id, db, schema=BillImportCreate)
+    
+    return StatementImportResult(
+        **result.model_dump(exclude={"skipped"}),
+        skipped=result.skipped + reader.skipped,
+        provider=reader.provider
+    )
+
+def encode_cursor(bill: Bill) -> str:
+    """分页游标：上一页最后一条账单的 (bill_date, id)，对客户端不透明"""
+    raw = f"{bill.bill_date.isoformat()}|{bill.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        bill_date, bill_id = raw.split("|")
+        return date.fromisoformat(bill_date), int(bill_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
 @router.get("", response_model=List[BillResponse])
-def get_bills(
+async def get_bills(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     category: Optional[str] = None,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取账单列表"""
-    query = db.query(Bill).filter(Bill.user_id == current_user.id)
+    """
+    获取账单列表（按账单日期倒序，同一天按ID倒序）
+    - cursor: 上一页响应头 X-Next-Cursor 的值，从该位置继续（走 (user_id, bill_date, id) 索引，翻到多深都不变慢），传入时忽略 skip
+    - skip: 兼容旧的偏移分页
+    - 本页取满 limit 条时响应头 X-Next-Cursor 为下一页的游标，没有该响应头表示已是最后一页
+    """
+    query = select(Bill).where(Bill.user_id == current_user.id)
     
     if category:
-        query = query.filter(Bill.category == category)
+        query = query.where(Bill.category == category)
     if start_date:
-        query = query.filter(Bill.bill_date >= start_date)
+        query = query.where(Bill.bill_date >= start_date)
     if end_date:
-        query = query.filter(Bill.bill_date <= end_date)
+        query = query.where(Bill.bill_date <= end_date)
+    
+    query = query.order_by(Bill.bill_date.desc(), Bill.id.desc()).limit(limit)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor)
+        # 单独的 bill_date <= last_date 条件让索引从游标位置开始范围扫描（只有 OR 条件时优化器可能扫描整个用户）
+        query = query.where(
+            Bill.bill_date <= last_date,
+            or_(Bill.bill_date < last_date, and_(Bill.bill_date == last_date, Bill.id < last_id))
+        )
+    else:
+        query = query.offset(skip)
     
-    bills = query.order_by(Bill.bill_date.desc()).offset(skip).limit(limit).all()
+    bills = (await db.scalars(query)).all()
+    if len(bills) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(bills[-1])
     return bills
 
+@router.get("/export")
+async def export_bills(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    category: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """
+    流式导出账单（CSV 或 NDJSON，按账单日期升序）
+    - 服务端游标分块读取，逐块编码写入响应，内存占用与账单数无关
+    - gzip=true 时返回 .gz 文件
+    """
+    statement = export_statement(current_user.id, category, start_date, end_date)
+    encoder = BillExportEncoder(format, compress=gzip)
+    
+    async def generate():
+        # 生成器在接口函数返回后才运行，使用自己的会话（不依赖框架关闭依赖项会话的时机），
+        # 导出完成或客户端断开时关闭
+        yield encoder.start()
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(statement)
+            async for rows in result.partitions():
+                yield encoder.encode(rows)
+        yield encoder.finish()
+    
+    return StreamingResponse(
+        generate(),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format, gzip)}"'}
+    )
+
 @router.get("/{bill_id}", response_model=BillResponse)
-def get_bill(
+async def get_bill(
     bill_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取单个账单详情"""
-    bill = db.query(Bill).filter(
+    bill = await db.scalar(select(Bill).where(
         Bill.id == bill_id,
         Bill.user_id == current_user.id
-    ).first()
+    ))
     if not bill:
         raise HTTPException(status_code=404, detail="Bill not found")
     return bill
 
 @router.put("/{bill_id}", response_model=BillResponse)
-def update_bill(
+async def update_bill(
     bill_id: int,
     bill_update: BillUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新账单"""
-    bill = db.query(Bill).filter(
+    bill = await db.scalar(select(Bill).where(
         Bill.id == bill_id,
         Bill.user_id == current_user.id
-    ).first()
+    ))
     if not bill:
         raise HTTPException(status_code=404, detail="Bill not found")
     
@@ -89,55 +244,38 @@ def update_bill(
     for field, value in update_data.items():
         setattr(bill, field, value)
     
-    db.commit()
-    db.refresh(bill)
+    await db.commit()
+    await db.refresh(bill)
     return bill
 
 @router.delete("/{bill_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_bill(
+async def delete_bill(
     bill_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除账单"""
-    bill = db.query(Bill).filter(
+    bill = await db.scalar(select(Bill).where(
         Bill.id == bill_id,
         Bill.user_id == current_user.id
-    ).first()
+    ))
     if not bill:
         raise HTTPException(status_code=404, detail="Bill not found")
     
-    db.delete(bill)
-    db.commit()
+    await db.delete(bill)
+    await db.commit()
     return None
 
 @router.get("/statistics/summary", response_model=BillStatistics)
-def get_statistics(
+async def get_statistics(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取账单统计信息"""
-    # 构建基础查询条件
-    base_filter = [Bill.user_id == current_user.id]
-    
-    # 添加日期过滤条件
-    if start_date:
-        base_filter.append(Bill.bill_date >= start_date)
-    if end_date:
-        base_filter.append(Bill.bill_date <= end_date)
-    
-    # 计算总收入
-    income_filter = base_filter + [Bill.category == "收入"]
-    total_income = db.query(func.sum(Bill.amount)).filter(*income_filter).scalar() or Decimal("0")
-    
-    # 计算总支出
-    expense_filter = base_filter + [Bill.category == "支出"]
-    total_expense = db.query(func.sum(Bill.amount)).filter(*expense_filter).scalar() or Decimal("0")
-    
-    # 计算账单数量
-    count = db.query(Bill).filter(*base_filter).count()
+    """获取账单统计信息（完整的月份读按月汇总表，首尾不完整的月份读账单表）"""
+    rows = (await db.execute(summary_statement(current_user.id, start_date, end_date))).all()
+    total_income, total_expense, count = merge_totals(rows).get(None, (Decimal("0"), Decimal("0"), 0))
     
     # 计算余额
     balance = total_income - total_expense
@@ -148,3 +286,53 @@ def get_statistics(
         balance=balance,
         count=count
     )
+
+@router.get("/statistics/timeseries", response_model=List[BillSeriesPoint])
+async def get_timeseries(
+    interval: str = Query("month", pattern="^(day|week|month)$"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    按天/周/月统计收入、支出和账单数（只返回有账单的时间段，按时间升序）
+    - month: 完整的月份读按月汇总表，首尾不完整的月份读账单表
+    - day/week: 按天分组读账单表覆盖索引，按周统计时合并到周一
+    """
+    if interval == "month":
+        statement = grouped_statement(current_user.id, start_date, end_date, by="month")
+    else:
+        statement = daily_statement(current_user.id, start_date, end_date)
+    rows = (await db.execute(statement)).all()
+    
+    if interval == "week":
+        rows = [(income, expense, count, day - timedelta(days=day.weekday())) for income, expense, count, day in rows]
+    totals = merge_totals(rows, by=interval)
+    
+    return [
+        BillSeriesPoint(period=period, total_income=income, total_expense=expense, count=count)
+        for period, (income, expense, count) in sorted(totals.items())
+    ]
+
+@router.get("/statistics/breakdown", response_model=List[BillBreakdownItem])
+async def get_breakdown(
+    by: str = Query("type", pattern="^(type|category)$"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    按消费类型或收支分类统计收入、支出和账单数（金额合计从大到小）
+    完整的月份读按月汇总表，首尾不完整的月份读账单表
+    """
+    rows = (await db.execute(grouped_statement(current_user.id, start_date, end_date, by=by))).all()
+    totals = merge_totals(rows, by=by)
+    
+    items = [
+        BillBreakdownItem(key=key, total_income=income, total_expense=expense, count=count)
+        for key, (income, expense, count) in totals.items()
+    ]
+    items.sort(key=lambda item: item.total_income + item.total_expense, reverse=True)
+    return items
@@ -2,40 +2,65 @@
 图片上传和账单解析路由
 """
 import os
-import shutil
 from pathlib import Path
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from typing import List, NamedTuple, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query
 from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
 from datetime import datetime
-from decimal import Decimal
+import asyncio
 
-from database import get_db
-from auth import get_current_user
-from models import User, Bill, BillImage
+from database import get_async_db
+from auth import CurrentUser, get_current_user
+from models import Bill, BillImage, OcrJob, ReparseJob
 from schemas import (
     BillImageResponse, 
     ImageUploadResponse, 
     BatchImageUploadResponse,
-    BillCreate,
-    BillResponse
+    ImageParseStatus,
+    ImageOcrLines,
+    BillResponse,
+    ReparseJobCreate,
+    ReparseJobResponse
 )
-from utils.ocr_parser import parse_bill_image
+from blob_store import UPLOAD_DIR, stage_upload, discard_staged, find_duplicate_image, store_blob
+from ocr_worker import (
+    dispatcher,
+    enqueue_ocr_job,
+    apply_parse_result,
+    extract_text_async,
+    extract_texts_batch_async
+)
+from reparse import create_reparse_job, job_progress, start_reparse_job
+from request_metrics import TimedRoute, span
+from utils.ocr_lines import decode_ocr_lines
+from utils.ocr_parser import ocr_cache, parse_bill_texts
 
-router = APIRouter(prefix="/api/images", tags=["图片"])
+router = APIRouter(prefix="/api/images", tags=["图片"], route_class=TimedRoute)
 
 # 上传目录配置
-UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif"}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_STATUS_WAIT = 30  # 查询解析状态时最长等待秒数
+
+class SavedFile(NamedTuple):
+    file_path: str
+    filename: str
+    file_size: int
+    content_hash: str
+    duplicate: Optional[BillImage]  # 该用户已上传过相同内容时为已有的图片记录
 
-def save_uploaded_file(file: UploadFile, user_id: int) -> tuple[str, str]:
+async def save_uploaded_file(file: UploadFile, user_id: int, db: AsyncSession) -> SavedFile:
     """
-    保存上传的文件
-    返回: (file_path, filename)
+    保存上传的文件（按内容去重，不提交事务）
+    文件读写和摘要计算在线程池中执行，blob_store 的同步函数通过 run_sync 在异步会话上运行
+    - 该用户已上传过相同内容的图片时不再保存，返回已有的图片记录
+    - 其他用户上传过相同内容时复用已存储的文件，只增加引用计数
     """
     # 检查文件扩展名
     file_ext = Path(file.filename).suffix.lower()
@@ -45,30 +70,51 @@ def save_uploaded_file(file: UploadFile, user_id: int) -> tuple[str, str]:
             detail=f"不支持的文件格式，仅支持: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
-    # 生成唯一文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    filename = f"{user_id}_{timestamp}{file_ext}"
-    file_path = UPLOAD_DIR / str(user_id) / filename
+    # 写入临时文件并计算内容摘要
+    with span("storage"):
+        staged = await run_in_threadpool(stage_upload, file, file_ext)
     
-    # 创建用户目录
-    file_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # 重复上传检测（索引查询）
+        duplicate = await db.run_sync(find_duplicate_image, user_id, staged.content_hash)
+        if duplicate:
+            discard_staged(staged)
+            return SavedFile(duplicate.file_path, duplicate.filename, staged.file_size, staged.content_hash, duplicate)
+        
+        blob = await db.run_sync(store_blob, staged)
+    except Exception:
+        discard_staged(staged)  # 已移入或已删除时忽略
+        raise
     
-    # 保存文件
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # 生成唯一文件名（用于展示和下载）
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    filename = f"{user_id}_{timestamp}{file_ext}"
     
-    return str(file_path), filename
+    return SavedFile(blob.file_path, filename, staged.file_size, staged.content_hash, None)
+
+async def _duplicate_response(db: AsyncSession, image: BillImage) -> ImageUploadResponse:
+    """重复上传时返回已有的图片记录及其关联账单"""
+    bill = None
+    if image.bill_id:
+        bill = await db.get(Bill, image.bill_id)
+    return ImageUploadResponse(
+        image=BillImageResponse.model_validate(image),
+        bill=BillResponse.model_validate(bill) if bill else None,
+        parsed_data=(image.ocr_result or {}).get("parsed_data"),
+        duplicate=True
+    )
 
 @router.post("/upload", response_model=ImageUploadResponse, status_code=status.HTTP_201_CREATED)
 async def upload_image(
     file: UploadFile = File(...),
     auto_create_bill: bool = True,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    上传单张图片并解析账单
+    上传单张图片，OCR解析在后台进行
     - auto_create_bill: 是否自动创建账单（如果解析成功）
+    - 返回的图片记录 parse_status 为 pending，可通过 /api/images/{image_id}/status 查询解析进度
     """
     try:
         # 检查文件大小
@@ -83,66 +129,38 @@ async def upload_image(
             )
         
         # 保存文件
-        file_path, filename = save_uploaded_file(file, current_user.id)
-        
-        # OCR解析
-        parse_result = parse_bill_image(file_path)
+        saved = await save_uploaded_file(file, current_user.id, db)
+        if saved.duplicate:
+            return await _duplicate_response(db, saved.duplicate)
         
-        # 创建图片记录（先不关联账单）
+        # 创建图片记录（先不关联账单），OCR解析交给后台任务
         bill_image = BillImage(
             user_id=current_user.id,
             bill_id=0,  # 临时值，解析成功后会更新
-            filename=filename,
-            file_path=file_path,
-            file_size=file_size,
+            filename=saved.filename,
+            file_path=saved.file_path,
+            file_size=saved.file_size,
             mime_type=file.content_type or "image/jpeg",
-            source_type=parse_result.get("bill_type", "unknown"),
-            ocr_result=parse_result,
-            parse_status="success" if parse_result.get("success") else "failed",
-            parse_error=parse_result.get("error")
+            parse_status="pending",
+            content_hash=saved.content_hash
         )
         db.add(bill_image)
-        db.flush()  # 获取ID但不提交
-        
-        bill = None
-        parsed_data = None
-        
-        # 如果解析成功且自动创建账单
-        if parse_result.get("success") and auto_create_bill:
-            parsed = parse_result.get("parsed_data", {})
-            parsed_data = parsed
-            
-            # 创建账单
-            bill = Bill(
-                user_id=current_user.id,
-                title=parsed.get("merchant") or f"账单-{datetime.now().strftime('%Y%m%d')}",
-                amount=parsed.get("amount") or Decimal("0.00"),
-                category=parsed.get("category", "支出"),
-                type=parsed.get("type", "其他"),
-                description=parsed.get("description", ""),
-                bill_date=datetime.strptime(parsed.get("date"), "%Y-%m-%d").date() if parsed.get("date") else datetime.now().date()
-            )
-            db.add(bill)
-            db.flush()
-            
-            # 更新图片记录的bill_id
-            bill_image.bill_id = bill.id
+        await db.flush()  # 获取ID但不提交
         
-        db.commit()
-        db.refresh(bill_image)
-        if bill:
-            db.refresh(bill)
+        job = await db.run_sync(enqueue_ocr_job, bill_image, auto_create_bill)
+        await db.commit()
+        await db.refresh(bill_image)
+        dispatcher.notify()
         
         return ImageUploadResponse(
             image=BillImageResponse.model_validate(bill_image),
-            bill=BillResponse.model_validate(bill) if bill else None,
-            parsed_data=parsed_data
+            job_id=job.id
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"上传失败: {str(e)}"
@@ -152,11 +170,14 @@ async def upload_image(
 async def upload_images_batch(
     files: List[UploadFile] = File(...),
     auto_create_bill: bool = True,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    mode: str = Query("queue", pattern="^(queue|sync)$"),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    批量上传多张图片并解析
+    批量上传多张图片
+    - mode=queue（默认）: 加入OCR任务队列后立即返回，success_count 为已接收的图片数
+    - mode=sync: 并行分发到OCR进程池，等待全部解析完成后在一个事务中写入，返回解析结果
     """
     if len(files) > 20:
         raise HTTPException(
@@ -164,6 +185,11 @@ async def upload_images_batch(
             detail="一次最多上传20张图片"
         )
     
+    # 出错回滚会使会话中的对象（包括 current_user）过期，异步会话中不能再隐式加载，先取出用户ID
+    user_id = current_user.id
+    if mode == "sync":
+        return await _upload_images_batch_sync(files, auto_create_bill, user_id, db)
+    
     results = []
     success_count = 0
     failed_count = 0
@@ -182,68 +208,39 @@ async def upload_images_batch(
                 )
             
             # 保存文件
-            file_path, filename = save_uploaded_file(file, current_user.id)
-            
-            # OCR解析
-            parse_result = parse_bill_image(file_path)
+            saved = await save_uploaded_file(file, user_id, db)
+            if saved.duplicate:
+                await db.commit()
+                results.append(await _duplicate_response(db, saved.duplicate))
+                success_count += 1
+                continue
             
-            # 创建图片记录
+            # 创建图片记录并加入OCR任务队列
             bill_image = BillImage(
-                user_id=current_user.id,
+                user_id=user_id,
                 bill_id=0,
-                filename=filename,
-                file_path=file_path,
-                file_size=file_size,
+                filename=saved.filename,
+                file_path=saved.file_path,
+                file_size=saved.file_size,
                 mime_type=file.content_type or "image/jpeg",
-                source_type=parse_result.get("bill_type", "unknown"),
-                ocr_result=parse_result,
-                parse_status="success" if parse_result.get("success") else "failed",
-                parse_error=parse_result.get("error")
+                parse_status="pending",
+                content_hash=saved.content_hash
             )
             db.add(bill_image)
-            db.flush()
-            
-            bill = None
-            parsed_data = None
+            await db.flush()
             
-            # 如果解析成功且自动创建账单
-            if parse_result.get("success") and auto_create_bill:
-                parsed = parse_result.get("parsed_data", {})
-                parsed_data = parsed
-                
-                bill = Bill(
-                    user_id=current_user.id,
-                    title=parsed.get("merchant") or f"账单-{datetime.now().strftime('%Y%m%d')}",
-                    amount=parsed.get("amount") or Decimal("0.00"),
-                    category=parsed.get("category", "支出"),
-                    type=parsed.get("type", "其他"),
-                    description=parsed.get("description", ""),
-                    bill_date=datetime.strptime(parsed.get("date"), "%Y-%m-%d").date() if parsed.get("date") else datetime.now().date()
-                )
-                db.add(bill)
-                db.flush()
-                
-                bill_image.bill_id = bill.id
+            job = await db.run_sync(enqueue_ocr_job, bill_image, auto_create_bill)
+            await db.commit()
+            await db.refresh(bill_image)
             
-            db.commit()
-            db.refresh(bill_image)
-            if bill:
-                db.refresh(bill)
-            
-            result = ImageUploadResponse(
+            results.append(ImageUploadResponse(
                 image=BillImageResponse.model_validate(bill_image),
-                bill=BillResponse.model_validate(bill) if bill else None,
-                parsed_data=parsed_data
-            )
-            results.append(result)
-            
-            if bill_image.parse_status == "success":
-                success_count += 1
-            else:
-                failed_count += 1
+                job_id=job.id
+            ))
+            success_count += 1
                 
         except HTTPException:
-            db.rollback()
+            await db.rollback()
             failed_count += 1
             results.append(ImageUploadResponse(
                 image=None,
@@ -251,7 +248,7 @@ async def upload_images_batch(
                 parsed_data=None
             ))
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             failed_count += 1
             results.append(ImageUploadResponse(
                 image=None,
@@ -259,44 +256,319 @@ async def upload_images_batch(
                 parsed_data=None
             ))
     
+    if success_count:
+        dispatcher.notify()
+    
     return BatchImageUploadResponse(
         success_count=success_count,
         failed_count=failed_count,
         results=results
     )
 
+async def _upload_images_batch_sync(
+    files: List[UploadFile],
+    auto_create_bill: bool,
+    user_id: int,
+    db: AsyncSession
+) -> BatchImageUploadResponse:
+    """
+    同步批量解析：图片按进程数分组并行提交到进程池，组内使用批量OCR推理，
+    按上传顺序收集结果，批量耗时取决于进程数而不是文件数
+    """
+    # 保存文件并创建图片记录，不合法的文件记为 None；
+    # 每条记录立即 flush，同一批次内的重复图片也能被检测到
+    entries = []
+    try:
+        for file in files:
+            try:
+                file.file.seek(0, 2)
+                file_size = file.file.tell()
+                file.file.seek(0)
+                
+                if file_size > MAX_FILE_SIZE:
+                    entries.append(None)
+                    continue
+                
+                saved = await save_uploaded_file(file, user_id, db)
+            except HTTPException:
+                entries.append(None)
+                continue
+            
+            if saved.duplicate:
+                entries.append(("duplicate", saved.duplicate))
+                continue
+            
+            bill_image = BillImage(
+                user_id=user_id,
+                bill_id=0,
+                filename=saved.filename,
+                file_path=saved.file_path,
+                file_size=saved.file_size,
+                mime_type=file.content_type or "image/jpeg",
+                parse_status="pending",
+                content_hash=saved.content_hash
+            )
+            db.add(bill_image)
+            await db.flush()
+            entries.append(("new", bill_image))
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"上传失败: {str(e)}"
+        )
+    
+    # 先查OCR缓存，未命中的图片按进程数分组批量OCR
+    new_images = [entry[1] for entry in entries if entry and entry[0] == "new"]
+    ocr_outputs = await extract_texts_batch_async([(image.file_path, image.content_hash) for image in new_images])
+    
+    # 一个事务内写入所有解析结果和账单
+    created = {}
+    try:
+        for bill_image, output in zip(new_images, ocr_outputs):
+            if isinstance(output, BaseException):
+                parse_result = {"success": False, "error": str(output), "bill_type": "unknown"}
+            else:
+                parse_result = parse_bill_texts(*output)
+            created[bill_image.id] = await db.run_sync(apply_parse_result, bill_image, parse_result, auto_create_bill)
+        
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"上传失败: {str(e)}"
+        )
+    
+    results = []
+    success_count = 0
+    failed_count = 0
+    for entry in entries:
+        if entry is None:
+            failed_count += 1
+            results.append(ImageUploadResponse(image=None, bill=None, parsed_data=None))
+            continue
+        
+        kind, bill_image = entry
+        if bill_image.parse_status == "success":
+            success_count += 1
+        else:
+            failed_count += 1
+        
+        if kind == "duplicate":
+            results.append(await _duplicate_response(db, bill_image))
+            continue
+        
+        bill, parsed_data = created[bill_image.id]
+        results.append(ImageUploadResponse(
+            image=BillImageResponse.model_validate(bill_image),
+            bill=BillResponse.model_validate(bill) if bill else None,
+            parsed_data=parsed_data
+        ))
+    
+    return BatchImageUploadResponse(
+        success_count=success_count,
+        failed_count=failed_count,
+        results=results
+    )
+
+@router.get("/ocr/cache")
+async def get_ocr_cache_stats(current_user: CurrentUser = Depends(get_current_user)):
+    """
+    OCR结果缓存命中统计（当前API进程）
+    """
+    return ocr_cache.stats()
+
+def _reparse_job_response(job: ReparseJob) -> ReparseJobResponse:
+    return ReparseJobResponse.model_validate(job).model_copy(update=job_progress(job))
+
+async def _get_reparse_job(db: AsyncSession, job_id: int, user_id: int) -> ReparseJob:
+    job = await db.scalar(select(ReparseJob).where(
+        ReparseJob.id == job_id,
+        ReparseJob.user_id == user_id
+    ))
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@router.post("/reparse-jobs", response_model=ReparseJobResponse, status_code=status.HTTP_201_CREATED)
+async def create_bulk_reparse_job(
+    job_data: ReparseJobCreate,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    批量重新解析当前用户的历史图片
+    按上传日期、解析状态、账单来源筛选，后台分批处理，通过 GET /reparse-jobs/{job_id} 查询进度
+    """
+    job = await db.run_sync(create_reparse_job, user_id=current_user.id, **job_data.model_dump())
+    await db.commit()
+    await run_in_threadpool(start_reparse_job, job.id)
+    await db.refresh(job)
+    return _reparse_job_response(job)
+
+@router.get("/reparse-jobs", response_model=List[ReparseJobResponse])
+async def list_bulk_reparse_jobs(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    获取当前用户的批量重新解析任务（最近的在前）
+    """
+    jobs = (await db.scalars(select(ReparseJob).where(
+        ReparseJob.user_id == current_user.id
+    ).order_by(ReparseJob.id.desc()).limit(50))).all()
+    return [_reparse_job_response(job) for job in jobs]
+
+@router.get("/reparse-jobs/{job_id}", response_model=ReparseJobResponse)
+async def get_bulk_reparse_job(
+    job_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    查询批量重新解析任务的进度和吞吐量
+    """
+    return _reparse_job_response(await _get_reparse_job(db, job_id, current_user.id))
+
+@router.post("/reparse-jobs/{job_id}/resume", response_model=ReparseJobResponse)
+async def resume_bulk_reparse_job(
+    job_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    从中断处继续失败、已取消或进程退出时中断的任务
+    """
+    job = await _get_reparse_job(db, job_id, current_user.id)
+    if not await run_in_threadpool(start_reparse_job, job.id):
+        raise HTTPException(status_code=409, detail="任务已完成或正在运行")
+    await db.refresh(job)
+    return _reparse_job_response(job)
+
+@router.post("/reparse-jobs/{job_id}/cancel", response_model=ReparseJobResponse)
+async def cancel_bulk_reparse_job(
+    job_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    取消任务（当前批次处理完后停止，已处理的结果保留，之后可以继续）
+    """
+    job = await _get_reparse_job(db, job_id, current_user.id)
+    if job.status not in ("queued", "running"):
+        raise HTTPException(status_code=409, detail="任务未在运行")
+    job.status = "cancelled"
+    await db.commit()
+    await db.refresh(job)
+    return _reparse_job_response(job)
+
 @router.get("/{image_id}", response_model=BillImageResponse)
-def get_image(
+async def get_image(
     image_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取图片信息
     """
-    image = db.query(BillImage).filter(
+    image = await db.scalar(select(BillImage).where(
         BillImage.id == image_id,
         BillImage.user_id == current_user.id
-    ).first()
+    ))
     
     if not image:
         raise HTTPException(status_code=404, detail="图片不存在")
     
     return image
 
+async def _load_parse_status(db: AsyncSession, image_id: int, user_id: int) -> Optional[ImageParseStatus]:
+    """查询图片解析状态"""
+    db.expire_all()  # 轮询时丢弃会话缓存，读取后台任务写入的最新状态
+    image = await db.scalar(select(BillImage).where(
+        BillImage.id == image_id,
+        BillImage.user_id == user_id
+    ))
+    if not image:
+        return None
+    
+    job_status = await db.scalar(select(OcrJob.status).where(
+        OcrJob.image_id == image_id
+    ).order_by(OcrJob.id.desc()).limit(1))
+    
+    return ImageParseStatus(
+        image_id=image.id,
+        parse_status=image.parse_status,
+        parse_error=image.parse_error,
+        bill_id=image.bill_id or None,
+        job_status=job_status
+    )
+
+@router.get("/{image_id}/status", response_model=ImageParseStatus)
+async def get_image_parse_status(
+    image_id: int,
+    wait: int = Query(0, ge=0, le=MAX_STATUS_WAIT),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    查询图片OCR解析状态
+    - wait: 长轮询等待秒数，解析仍在进行时最多等待该时长再返回
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    user_id = current_user.id  # 轮询时会话对象会被过期，先取出用户ID
+    
+    while True:
+        result = await _load_parse_status(db, image_id, user_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        if result.parse_status != "pending" or loop.time() >= deadline:
+            return result
+        await asyncio.sleep(0.5)
+
+@router.get("/{image_id}/ocr", response_model=ImageOcrLines)
+async def get_image_ocr_lines(
+    image_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    获取图片的OCR原始文本行（文本、置信度、文本框坐标）及OCR/解析规则版本
+    """
+    image = await db.scalar(select(BillImage).options(undefer(BillImage.ocr_lines)).where(
+        BillImage.id == image_id,
+        BillImage.user_id == current_user.id
+    ))
+    
+    if not image:
+        raise HTTPException(status_code=404, detail="图片不存在")
+    
+    lines = decode_ocr_lines(image.ocr_lines)
+    if lines is None:
+        # 旧记录的文本行保存在 ocr_result 中
+        lines = (image.ocr_result or {}).get("ocr_results") or []
+    
+    return ImageOcrLines(
+        image_id=image.id,
+        ocr_model_version=image.ocr_model_version,
+        parser_version=image.parser_version,
+        lines=lines
+    )
+
 @router.get("/{image_id}/file")
-def get_image_file(
+async def get_image_file(
     image_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取图片文件
     """
-    image = db.query(BillImage).filter(
+    image = await db.scalar(select(BillImage).where(
         BillImage.id == image_id,
         BillImage.user_id == current_user.id
-    ).first()
+    ))
     
     if not image:
         raise HTTPException(status_code=404, detail="图片不存在")
@@ -311,56 +583,56 @@ def get_image_file(
     )
 
 @router.get("/bill/{bill_id}/images", response_model=List[BillImageResponse])
-def get_bill_images(
+async def get_bill_images(
     bill_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取账单关联的所有图片
     """
     # 验证账单所有权
-    bill = db.query(Bill).filter(
+    bill = await db.scalar(select(Bill).where(
         Bill.id == bill_id,
         Bill.user_id == current_user.id
-    ).first()
+    ))
     
     if not bill:
         raise HTTPException(status_code=404, detail="账单不存在")
     
-    images = db.query(BillImage).filter(
+    images = (await db.scalars(select(BillImage).where(
         BillImage.bill_id == bill_id,
         BillImage.user_id == current_user.id
-    ).all()
+    ))).all()
     
     return images
 
 @router.delete("/{image_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_image(
+async def delete_image(
     image_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     删除图片
     """
-    image = db.query(BillImage).filter(
+    image = await db.scalar(select(BillImage).where(
         BillImage.id == image_id,
         BillImage.user_id == current_user.id
-    ).first()
+    ))
     
     if not image:
         raise HTTPException(status_code=404, detail="图片不存在")
     
-    # 删除文件
-    if os.path.exists(image.file_path):
+    # 删除文件（按内容去重存储的文件由引用计数管理，引用归零时自动删除）
+    if not image.content_hash and os.path.exists(image.file_path):
         try:
             os.remove(image.file_path)
         except:
             pass  # 忽略删除文件错误
     
-    db.delete(image)
-    db.commit()
+    await db.delete(image)
+    await db.commit()
     
     return None
 
@@ -368,16 +640,16 @@ def delete_image(
 async def reparse_image(
     image_id: int,
     auto_create_bill: bool = False,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     重新解析图片
     """
-    image = db.query(BillImage).filter(
+    image = await db.scalar(select(BillImage).where(
         BillImage.id == image_id,
         BillImage.user_id == current_user.id
-    ).first()
+    ))
     
     if not image:
         raise HTTPException(status_code=404, detail="图片不存在")
@@ -385,41 +657,24 @@ async def reparse_image(
     if not os.path.exists(image.file_path):
         raise HTTPException(status_code=404, detail="图片文件不存在")
     
-    # 重新解析
-    parse_result = parse_bill_image(image.file_path)
-    
-    # 更新图片记录
-    image.ocr_result = parse_result
-    image.parse_status = "success" if parse_result.get("success") else "failed"
-    image.parse_error = parse_result.get("error")
-    image.source_type = parse_result.get("bill_type", "unknown")
-    
-    bill = None
-    parsed_data = None
+    # 重新解析（OCR在进程池中执行，图片未变化时命中缓存）
+    # 上次解析成功时账单类型已知，OCR只需处理该类账单的字段区域
+    bill_type = image.source_type if image.parse_status == "success" else None
+    try:
+        # 文本行记为实际命中或识别时的版本：按区域识别的结果批量重新解析时不会当作整图结果复用，
+        # 命中整图缓存时仍记为整图版本
+        texts, timings, version = await extract_text_async(image.file_path, image.content_hash, bill_type)
+        parse_result = parse_bill_texts(texts, timings, version)
+    except Exception as e:
+        parse_result = {"success": False, "error": str(e), "bill_type": "unknown"}
     
-    # 如果解析成功且需要创建账单
-    if parse_result.get("success") and auto_create_bill:
-        parsed = parse_result.get("parsed_data", {})
-        parsed_data = parsed
-        
-        bill = Bill(
-            user_id=current_user.id,
-            title=parsed.get("merchant") or f"账单-{datetime.now().strftime('%Y%m%d')}",
-            amount=parsed.get("amount") or Decimal("0.00"),
-            category=parsed.get("category", "支出"),
-            type=parsed.get("type", "其他"),
-            description=parsed.get("description", ""),
-            bill_date=datetime.strptime(parsed.get("date"), "%Y-%m-%d").date() if parsed.get("date") else datetime.now().date()
-        )
-        db.add(bill)
-        db.flush()
-        
-        image.bill_id = bill.id
+    # 更新图片记录，需要时创建账单
+    bill, parsed_data = await db.run_sync(apply_parse_result, image, parse_result, auto_create_bill)
     
-    db.commit()
+    await db.commit()
     if bill:
-        db.refresh(bill)
-    db.refresh(image)
+        await db.refresh(bill)
+    await db.refresh(image)
     
     return ImageUploadResponse(
         image=BillImageResponse.model_validate(image),
@@ -0,0 +1,110 @@
+"""
+已有数据库的表结构升级
+Base.metadata.create_all 只创建不存在的表，已有表上新增的列和索引（如 bill_images.ocr_lines、
+bills.external_id 及其唯一键、统计覆盖索引）不会补上。API启动时按模型比对数据库，补齐缺少的列和索引；
+也可以手动执行：
+    python schema_upgrade.py          # 补齐缺少的列和索引
+    python schema_upgrade.py --sql    # 只打印需要执行的语句（交给DBA执行）
+只做增加列和索引，不修改或删除已有的列、索引
+"""
+import argparse
+import logging
+from typing import List, Set, Tuple
+
+from sqlalchemy import MetaData, UniqueConstraint, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateColumn
+
+logger = logging.getLogger(__name__)
+
+def _existing_keys(inspector, table_name: str) -> Set[Tuple[Tuple[str, ...], bool]]:
+    """已有索引和唯一约束的 (列, 是否唯一)；按列比对，不依赖名称（schema.sql 与模型的索引名不同）"""
+    keys = {
+        (tuple(index["column_names"]), bool(index.get("unique")))
+        for index in inspector.get_indexes(table_name)
+    }
+    keys |= {
+        (tuple(constraint["column_names"]), True)
+        for constraint in inspector.get_unique_constraints(table_name)
+    }
+    primary = inspector.get_pk_constraint(table_name).get("constrained_columns") or []
+    if primary:
+        keys.add((tuple(primary), True))
+    return keys
+
+def upgrade_statements(engine: Engine, metadata: MetaData) -> List[str]:
+    """已有表缺少的列和索引对应的 ALTER TABLE / CREATE INDEX 语句（表不存在时由 create_all 创建，这里跳过）"""
+    inspector = inspect(engine)
+    dialect = engine.dialect
+    preparer = dialect.identifier_preparer
+    existing_tables = set(inspector.get_table_names())
+    statements = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        table_sql = preparer.format_table(table)
+
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable and column.server_default is None:
+                raise RuntimeError(f"{table.name}.{column.name} 不允许为空且没有默认值，需要手动迁移")
+            statements.append(f"ALTER TABLE {table_sql} ADD COLUMN {CreateColumn(column).compile(dialect=dialect)}")
+
+        existing_keys = _existing_keys(inspector, table.name)
+        wanted = [(index.name, [column.name for column in index.columns], index.unique) for index in table.indexes]
+        wanted += [
+            (constraint.name or f"uq_{table.name}_{'_'.join(constraint.columns.keys())}",
+             constraint.columns.keys(), True)
+            for constraint in table.constraints if isinstance(constraint, UniqueConstraint)
+        ]
+        for name, columns, unique in wanted:
+            if (tuple(columns), True) in existing_keys or (tuple(columns), unique) in existing_keys:
+                continue
+            # 唯一约束也建成唯一索引（MySQL中二者相同，SQLite不支持给已有表添加约束）
+            statements.append(
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX {preparer.quote(name)} ON {table_sql} "
+                f"({', '.join(preparer.quote(column) for column in columns)})"
+            )
+    return statements
+
+def upgrade_schema(engine: Engine, metadata: MetaData) -> int:
+    """
+    补齐已有表缺少的列和索引，返回执行的语句数
+    多个进程同时启动时，已被其他进程执行的语句会失败，跳过后重新比对，仍有缺少的列或索引才报错
+    """
+    statements = upgrade_statements(engine, metadata)
+    for statement in statements:
+        logger.warning("升级表结构: %s", statement)
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(statement)
+        except SQLAlchemyError as e:
+            logger.warning("语句执行失败（可能其他进程已执行）: %s", e)
+    if statements:
+        remaining = upgrade_statements(engine, metadata)
+        if remaining:
+            raise RuntimeError("表结构升级失败，请手动执行:\n" + ";\n".join(remaining) + ";")
+    return len(statements)
+
+def main():
+    from database import Base, engine
+    import models  # noqa: F401  注册所有表
+
+    parser = argparse.ArgumentParser(description="补齐已有表缺少的列和索引")
+    parser.add_argument("--sql", action="store_true", help="只打印需要执行的语句，不执行")
+    args = parser.parse_args()
+
+    if args.sql:
+        for statement in upgrade_statements(engine, Base.metadata):
+            print(f"{statement};")
+        return
+    Base.metadata.create_all(bind=engine)
+    count = upgrade_schema(engine, Base.metadata)
+    print(f"已执行 {count} 条升级语句" if count else "表结构已是最新")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from datetime import date, datetime
-from typing import Optional
+from typing import Literal, Optional
 from decimal import Decimal
 
 # 用户相关Schema
@@ -30,6 +30,9 @@ class BillBase(BaseModel):
 class BillCreate(BillBase):
     pass
 
+class BillImportCreate(BillCreate):
+    external_id: Optional[str] = None  # 支付宝/微信交易单号，导入账单明细时用于去重
+
 class BillUpdate(BaseModel):
     title: Optional[str] = None
     amount: Optional[Decimal] = None
@@ -51,17 +54,47 @@ class BillResponse(BillBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[int] = None  # 令牌中的 uid，旧令牌没有
 
 # 统计相关Schema
+class BillImportError(BaseModel):
+    row: int  # JSON为第几条（从1开始），CSV为行号（表头为第1行）
+    error: str
+
+class BillImportResult(BaseModel):
+    created: int
+    failed: int
+    skipped: int = 0  # 已导入过的交易，以及账单明细中不计收支、交易关闭的行
+    errors: list[BillImportError]  # 最多返回前100条错误
+    error: Optional[str] = None  # 文件读到中途出错（编码、CSV格式）时的原因，出错前读到的行已导入
+
+class StatementImportResult(BillImportResult):
+    provider: str  # alipay / wechat
+
 class BillStatistics(BaseModel):
     total_income: Decimal
     total_expense: Decimal
     balance: Decimal
     count: int
 
+class BillTotals(BaseModel):
+    total_income: Decimal
+    total_expense: Decimal
+    count: int
+
+class BillSeriesPoint(BillTotals):
+    period: date  # 时间段第一天（按周统计时为周一）
+
+class BillBreakdownItem(BillTotals):
+    key: str  # 消费类型或收支分类
+
 # 图片相关Schema
 class BillImageBase(BaseModel):
     filename: str
@@ -90,8 +123,65 @@ class ImageUploadResponse(BaseModel):
     image: Optional[BillImageResponse] = None
     bill: Optional[BillResponse] = None
     parsed_data: Optional[dict] = None
+    job_id: Optional[int] = None  # OCR任务ID，解析在后台完成
+    duplicate: bool = False  # 是否为重复上传（返回已有的图片记录）
+
+class ImageParseStatus(BaseModel):
+    image_id: int
+    parse_status: str  # pending/success/failed
+    parse_error: Optional[str] = None
+    bill_id: Optional[int] = None
+    job_status: Optional[str] = None  # queued/running/done/failed
+
+class OcrLine(BaseModel):
+    text: str
+    confidence: float
+    bbox: list[int]
+
+class ImageOcrLines(BaseModel):
+    image_id: int
+    ocr_model_version: Optional[str] = None
+    parser_version: Optional[str] = None
+    lines: list[OcrLine]
 
 class BatchImageUploadResponse(BaseModel):
     success_count: int
     failed_count: int
     results: list[ImageUploadResponse]
+
+# 批量重新解析相关Schema
+class ReparseJobCreate(BaseModel):
+    date_from: Optional[date] = None  # 按图片上传日期筛选
+    date_to: Optional[date] = None
+    parse_status: Optional[str] = None  # pending/success/failed
+    source_type: Optional[str] = None  # alipay/wechat/unknown
+    ocr_mode: Literal["auto", "always"] = "auto"  # auto: OCR文本有效时只重新解析文本；always: 总是重新OCR
+    auto_create_bill: bool = False  # 解析成功且未关联账单的图片是否创建账单
+
+class ReparseJobResponse(BaseModel):
+    id: int
+    user_id: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    parse_status: Optional[str] = None
+    source_type: Optional[str] = None
+    ocr_mode: str
+    auto_create_bill: bool
+    status: str  # queued/running/done/failed/cancelled
+    total: int
+    processed: int
+    skipped: int
+    text_only: int
+    reocr: int
+    succeeded: int
+    failed: int
+    percent: float = 0.0
+    images_per_second: float = 0.0
+    eta_seconds: Optional[int] = None
+    error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
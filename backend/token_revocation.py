@@ -0,0 +1,71 @@
+"""
+刷新令牌吊销列表
+吊销的刷新令牌（jti）写入 revoked_tokens 表，同时记在进程内的字典中，换取访问令牌时只查字典，不查询数据库。
+其他进程吊销的令牌按自增ID增量同步（最多 TOKEN_REVOCATION_SYNC_INTERVAL 秒一次），令牌过期后从字典和表中清除
+"""
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models import RevokedToken
+
+def _timestamp(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+class RevocationList:
+    """进程内的已吊销刷新令牌：jti -> 令牌过期时间戳"""
+
+    def __init__(self):
+        self._expires: Dict[str, float] = {}
+        self._last_id = 0  # 已同步到的 revoked_tokens.id
+        self._synced_at: Optional[float] = None
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self._expires
+
+    async def sync(self, db: AsyncSession, force: bool = False):
+        """距上次同步超过 TOKEN_REVOCATION_SYNC_INTERVAL 秒时，读取上次之后新增的吊销记录；首次同步时顺便删除已过期的记录"""
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+            return
+        if self._synced_at is None:
+            await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= datetime.utcnow()))
+            await db.commit()
+        rows = await db.execute(
+            select(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at)
+            .where(RevokedToken.id > self._last_id)
+            .order_by(RevokedToken.id)
+        )
+        for row in rows:
+            self._expires[row.jti] = _timestamp(row.expires_at)
+            self._last_id = max(self._last_id, row.id)
+        self._prune()
+        self._synced_at = now
+
+    async def revoke(self, db: AsyncSession, jti: str, user_id: int, expires: float):
+        """吊销刷新令牌（本进程立即生效），已吊销过时忽略"""
+        self._expires[jti] = expires
+        db.add(RevokedToken(
+            jti=jti, user_id=user_id,
+            expires_at=datetime.fromtimestamp(expires, timezone.utc).replace(tzinfo=None)
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+
+    def _prune(self):
+        now = time.time()
+        expired = [jti for jti, expires in self._expires.items() if expires <= now]
+        for jti in expired:
+            del self._expires[jti]
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+revoked_tokens = RevocationList()
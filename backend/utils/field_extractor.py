@@ -0,0 +1,228 @@
+"""
+账单字段提取引擎
+正则在模块加载时预编译；所有关键词（账单类型识别、收支判断、消费类型）合并成一个正则，
+对全文只扫描一遍得到出现过的关键词集合，之后的判断都是集合查询。
+各支付平台的差异以 ProviderRules 数据描述，新增平台只需在 PROVIDERS 中加一项。
+"""
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Pattern, Tuple
+
+# 解析规则版本：修改下列规则或提取逻辑时递增，批量重新解析据此判断已有结果是否过期
+PARSER_VERSION = "2"
+
+# 金额（匹配 ¥123.45 或 123.45 元），按顺序取第一个命中的模式
+AMOUNT_PATTERNS = [re.compile(p) for p in (
+    r'[¥￥]\s*(\d+\.?\d*)',
+    r'(\d+\.?\d*)\s*元',
+    r'金额[：:]\s*[¥￥]?\s*(\d+\.?\d*)',
+    r'(\d+\.?\d*)\s*[元块]'
+)]
+
+# 日期（匹配 2024-01-01 或 2024/01/01 或 2024年1月1日）
+DATE_PATTERNS = [re.compile(p) for p in (
+    r'(\d{4})[年\-/](\d{1,2})[月\-/](\d{1,2})[日]?',
+    r'(\d{4})-(\d{2})-(\d{2})',
+    r'(\d{4})/(\d{2})/(\d{2})'
+)]
+
+# 消费类型及其关键词，按顺序取第一个命中的类型
+TYPE_KEYWORDS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("餐饮", ("餐饮", "餐厅", "饭店", "美食", "外卖")),
+    ("交通", ("交通", "打车", "地铁", "公交", "滴滴", "出租车")),
+    ("购物", ("购物", "商城", "超市", "商店", "购买")),
+    ("娱乐", ("娱乐", "电影", "KTV", "游戏")),
+    ("工资", ("工资", "薪资", "收入")),
+    ("奖金", ("奖金", "奖励")),
+]
+
+# 商户名兜底：前几行中第一行不是金额、不是日期的文本
+MERCHANT_FALLBACK_LINES = 5
+_AMOUNT_LINE = re.compile(r'^[¥￥]?\d+\.?\d*')
+_DATE_LINE = re.compile(r'^\d{4}')
+
+def _merchant_patterns(*labels: str) -> List[Pattern]:
+    return [re.compile(label + r'[：:]\s*([^\n]+)') for label in labels]
+
+class ProviderRules(NamedTuple):
+    """单个支付平台的解析规则"""
+    name: str
+    detect_keywords: Tuple[str, ...]  # 识别账单类型的关键词，命中个数最多的平台胜出
+    merchant_patterns: List[Pattern]  # 商户名模式，按顺序取第一个命中的
+    income_keywords: Tuple[str, ...]  # 出现任一即为收入
+    expense_keywords: Tuple[str, ...]  # 未判为收入时，出现任一即为支出
+
+# 命中个数相同时排在前面的平台优先；未识别的账单按 DEFAULT_PROVIDER 的规则解析
+PROVIDERS: Dict[str, ProviderRules] = {
+    "wechat": ProviderRules(
+        name="wechat",
+        detect_keywords=("微信支付", "WeChat", "微信", "收款", "付款", "零钱"),
+        merchant_patterns=_merchant_patterns("收款方", "商户", "商家", "收款人", "对方"),
+        income_keywords=("收款", "收入", "收到"),
+        expense_keywords=("付款", "支出", "支付"),
+    ),
+    "alipay": ProviderRules(
+        name="alipay",
+        detect_keywords=("支付宝", "Alipay", "收款", "付款", "余额", "账单"),
+        merchant_patterns=_merchant_patterns("收款方", "商户", "商家", "收款人"),
+        income_keywords=("收款", "收入"),
+        expense_keywords=("付款", "支出"),
+    ),
+}
+DEFAULT_PROVIDER = "alipay"
+
+def _trie_regex(words: Iterable[str]) -> str:
+    """
+    把关键词列表编译成前缀树形状的正则（如 微信(?:支付)?），
+    每个位置只需按首字符走一条分支，比几十个并列分支快得多；贪婪匹配保证取最长的关键词
+    """
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def render(node: Dict) -> str:
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return body + "?" if len(branches) == 1 and len(body) == 1 else "(?:" + body + ")?"
+        return body
+
+    return render(trie)
+
+class KeywordScanner:
+    """
+    单遍多关键词匹配
+    所有关键词合并为一个前缀树形状的正则，用 findall 扫描一遍（不重叠地取每处最长的关键词）。
+    被命中的关键词“吞掉”的其他关键词由预先计算的两张表补齐：
+    - 子串表：命中“微信支付”即说明“微信”“支付”也出现过
+    - 重叠表：前缀与命中关键词的后缀重合的关键词（如“微信支付”之后的“支付宝”），命中时再单独确认
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        unique = sorted(set(keywords), key=len, reverse=True)
+        self._pattern = re.compile(_trie_regex(unique))
+        self._contained: Dict[str, FrozenSet[str]] = {
+            keyword: frozenset(k for k in unique if k in keyword)
+            for keyword in unique
+        }
+        overlapping = {
+            keyword: tuple(
+                k for k in unique
+                if k not in keyword and any(k.startswith(keyword[i:]) for i in range(1, len(keyword)))
+            )
+            for keyword in unique
+        }
+        self._overlapping: Dict[str, Tuple[str, ...]] = {k: v for k, v in overlapping.items() if v}
+
+    def scan(self, text: str) -> FrozenSet[str]:
+        """返回 text 中出现过的全部关键词"""
+        matched = set(self._pattern.findall(text))
+        found = frozenset().union(*map(self._contained.__getitem__, matched))
+        extra = [
+            candidate
+            for keyword in matched.intersection(self._overlapping)
+            for candidate in self._overlapping[keyword]
+            if candidate not in found and candidate in text
+        ]
+        return found.union(extra) if extra else found
+
+_scanner = KeywordScanner(
+    [k for rules in PROVIDERS.values() for k in rules.detect_keywords + rules.income_keywords + rules.expense_keywords]
+    + [k for _, keywords in TYPE_KEYWORDS for k in keywords]
+)
+
+class ScannedText(NamedTuple):
+    """OCR文本及其关键词扫描结果，识别账单类型和解析字段时共用"""
+    texts: List[Dict]
+    full_text: str
+    keywords: FrozenSet[str]
+
+def scan_texts(texts: List[Dict]) -> ScannedText:
+    full_text = "\n".join([item["text"] for item in texts])
+    return ScannedText(texts, full_text, _scanner.scan(full_text))
+
+def detect_provider(scanned: ScannedText) -> str:
+    """按关键词命中个数识别账单类型，均未命中时返回 unknown"""
+    best, best_count = "unknown", 0
+    for name, rules in PROVIDERS.items():
+        count = len(scanned.keywords.intersection(rules.detect_keywords))
+        if count > best_count:
+            best, best_count = name, count
+    return best
+
+def scan_keywords(text: str) -> FrozenSet[str]:
+    """返回 text 中出现过的全部关键词（账单明细导入时对单个字段扫描）"""
+    return _scanner.scan(text)
+
+def first_amount(full_text: str) -> Optional[Decimal]:
+    for pattern in AMOUNT_PATTERNS:
+        match = pattern.search(full_text)
+        if match:
+            try:
+                return Decimal(match.group(1))
+            except InvalidOperation:
+                continue
+    return None
+
+def first_date(full_text: str) -> Optional[str]:
+    for pattern in DATE_PATTERNS:
+        match = pattern.search(full_text)
+        if match:
+            year, month, day = match.groups()
+            return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+    return None
+
+def classify_category(keywords: FrozenSet[str], provider: str) -> Optional[str]:
+    """按平台的收支关键词判断收入/支出，都未命中时返回 None"""
+    rules = PROVIDERS.get(provider) or PROVIDERS[DEFAULT_PROVIDER]
+    if not keywords.isdisjoint(rules.income_keywords):
+        return "收入"
+    if not keywords.isdisjoint(rules.expense_keywords):
+        return "支出"
+    return None
+
+def classify_type(keywords: FrozenSet[str]) -> str:
+    """按 TYPE_KEYWORDS 顺序取第一个命中的消费类型，都未命中时为“其他”"""
+    for bill_type, type_keywords in TYPE_KEYWORDS:
+        if not keywords.isdisjoint(type_keywords):
+            return bill_type
+    return "其他"
+
+def extract_fields(scanned: ScannedText, provider: str) -> Dict:
+    """按平台规则从OCR文本中提取账单字段"""
+    rules = PROVIDERS.get(provider) or PROVIDERS[DEFAULT_PROVIDER]
+    full_text = scanned.full_text
+    keywords = scanned.keywords
+
+    result = {
+        "amount": first_amount(full_text),
+        "date": first_date(full_text) or datetime.now().strftime("%Y-%m-%d"),
+        "merchant": None,
+        "category": classify_category(keywords, provider) or "支出",
+        "type": classify_type(keywords),
+        "description": ""
+    }
+
+    for pattern in rules.merchant_patterns:
+        match = pattern.search(full_text)
+        if match:
+            result["merchant"] = match.group(1).strip()
+            result["description"] = match.group(1).strip()
+            break
+
+    # 如果没有找到商户名，取前几行中第一行非金额、非日期的文本
+    if not result["merchant"]:
+        for item in scanned.texts[:MERCHANT_FALLBACK_LINES]:
+            text = item["text"].strip()
+            if text and not _AMOUNT_LINE.match(text) and not _DATE_LINE.match(text):
+                result["merchant"] = text
+                result["description"] = text
+                break
+
+    return result
@@ -0,0 +1,75 @@
+"""
+HMAC 签名（HS256/HS384/HS512）的 JWT 签发与校验
+只实现本项目用到的部分：密钥和令牌头在构造时准备好，每次签发/校验只做一次 HMAC 和一次 JSON 编解码，
+生成的令牌与 python-jose 逐字节一致，二者签发的令牌可以互相校验
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict
+
+HASH_ALGORITHMS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+class TokenError(ValueError):
+    """令牌格式、签名或有效期校验失败"""
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+class HmacJWT:
+    """用同一个密钥签发和校验令牌；校验要求令牌头的 alg 与构造时一致，带 exp/nbf 时检查有效期"""
+
+    def __init__(self, secret: str, algorithm: str = "HS256"):
+        if algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"不支持的令牌签名算法: {algorithm}")
+        self.algorithm = algorithm
+        self._mac = hmac.new(secret.encode("utf-8"), digestmod=HASH_ALGORITHMS[algorithm])
+        # 与 python-jose 相同的令牌头（键排序、无空白），校验时令牌头与它相同就不必再解析
+        self._header = _b64encode(json.dumps(
+            {"alg": algorithm, "typ": "JWT"}, separators=(",", ":"), sort_keys=True
+        ).encode("utf-8")).decode("ascii")
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8")).decode("ascii")
+        signing_input = f"{self._header}.{payload}"
+        return f"{signing_input}.{_b64encode(self._sign(signing_input.encode('ascii'))).decode('ascii')}"
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """校验签名和有效期，返回令牌内容；校验失败抛出 TokenError"""
+        try:
+            signing_input, signature = token.rsplit(".", 1)
+            header, payload = signing_input.split(".")
+            if not hmac.compare_digest(self._sign(signing_input.encode("ascii")), _b64decode(signature)):
+                raise TokenError("签名无效")
+            if header != self._header and json.loads(_b64decode(header)).get("alg") != self.algorithm:
+                raise TokenError("签名算法不匹配")
+            claims = json.loads(_b64decode(payload))
+        except TokenError:
+            raise
+        except (ValueError, TypeError, AttributeError, UnicodeError) as e:
+            raise TokenError(f"令牌格式错误: {e}") from e
+        if not isinstance(claims, dict):
+            raise TokenError("令牌格式错误")
+
+        now = time.time()
+        exp = claims.get("exp")
+        if exp is not None and (not isinstance(exp, (int, float)) or exp <= now):
+            raise TokenError("令牌已过期")
+        nbf = claims.get("nbf")
+        if nbf is not None and (not isinstance(nbf, (int, float)) or nbf > now):
+            raise TokenError("令牌尚未生效")
+        return claims
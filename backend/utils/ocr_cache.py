@@ -0,0 +1,173 @@
+"""
+OCR结果缓存
+以图片内容的SHA-256（加上OCR模型版本与预处理参数）为键，缓存 extract_text_from_image 的输出。
+两级缓存：进程内LRU + 磁盘（多进程、重启后共享）
+磁盘缓存超过 disk_max_bytes 时按最后访问时间（命中时更新文件修改时间）删除最旧的文件，降到上限的90%
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+def file_digest(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA-256"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class OcrResultCache:
+    """
+    OCR结果两级缓存
+    - memory_size: 内存LRU最大条目数
+    - cache_dir: 磁盘缓存目录，为空时只使用内存缓存
+    - disk_max_bytes: 磁盘缓存总大小上限，0 表示不限
+    """
+
+    # 清理时降到上限的比例，避免每次写入都扫描目录
+    PRUNE_TARGET = 0.9
+
+    def __init__(self, memory_size: int, cache_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self._memory = LRUCache(memory_size)
+        self._dir = Path(cache_dir) if cache_dir else None
+        self._disk_max_bytes = disk_max_bytes
+        self._disk_bytes: Optional[int] = None  # 估算的磁盘缓存大小（首次写入时扫描目录，其他进程的写入在下次清理时计入）
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "disk_evictions": 0}
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        """读取缓存，未命中返回 None"""
+        texts = self._memory.get(key)
+        if texts is not None:
+            self._count("memory_hits")
+            return texts
+
+        texts = self._read_disk(key)
+        if texts is not None:
+            self._memory.set(key, texts)
+            self._count("disk_hits")
+            return texts
+
+        self._count("misses")
+        return None
+
+    def put(self, key: str, texts: List[Dict]):
+        """写入缓存"""
+        self._memory.set(key, texts)
+        self._write_disk(key, texts)
+        self._count("stores")
+
+    def stats(self) -> Dict:
+        """命中统计（仅当前进程）"""
+        with self._lock:
+            counters = dict(self._counters)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        counters["hits"] = hits
+        counters["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        counters["memory_entries"] = len(self._memory)
+        return counters
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _disk_path(self, key: str) -> Path:
+        return self._dir / key[:2] / f"{key}.json"
+
+    def _read_disk(self, key: str) -> Optional[List[Dict]]:
+        if self._dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                texts = json.load(f)
+            if self._disk_max_bytes:
+                os.utime(path)  # 记录访问时间，清理时保留最近用到的结果
+            return texts
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning("OCR磁盘缓存读取失败: %s", key)
+            return None
+
+    def _write_disk(self, key: str, texts: List[Dict]):
+        if self._dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 先写临时文件再替换，避免并发读到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            data = json.dumps(texts, ensure_ascii=False).encode("utf-8")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning("OCR磁盘缓存写入失败: %s", key)
+            return
+        if self._disk_max_bytes:
+            self._track_disk_bytes(len(data))
+
+    def _scan_disk(self) -> List[Tuple[float, int, Path]]:
+        """磁盘缓存文件的 (修改时间, 大小, 路径)"""
+        entries = []
+        for path in self._dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # 其他进程刚刚删除
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _track_disk_bytes(self, size: int):
+        """累计写入的大小，超过上限时清理（其他线程正在清理时跳过）"""
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(entry[1] for entry in self._scan_disk())
+            else:
+                self._disk_bytes += size
+            if self._disk_bytes > self._disk_max_bytes:
+                self._prune()
+        finally:
+            self._prune_lock.release()
+
+    def _prune(self):
+        """按修改时间从旧到新删除文件，直到总大小不超过上限的 PRUNE_TARGET"""
+        start = time.perf_counter()
+        entries = self._scan_disk()
+        total = sum(entry[1] for entry in entries)
+        target = int(self._disk_max_bytes * self.PRUNE_TARGET)
+        removed = 0
+        if total > self._disk_max_bytes:
+            entries.sort(key=lambda entry: entry[0])
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    logger.warning("OCR磁盘缓存删除失败: %s", path)
+                    continue
+                total -= size
+                removed += 1
+        self._disk_bytes = total
+        if removed:
+            self._count("disk_evictions", removed)
+            logger.info("OCR磁盘缓存清理 %d 个文件，剩余 %d 字节，耗时 %.0fms",
+                        removed, total, (time.perf_counter() - start) * 1000)
@@ -0,0 +1,20 @@
+"""
+OCR文本行的紧凑编码
+每行编码为 [文本, 置信度, 文本框坐标]，整体为无空白的JSON后用 zlib 压缩，
+存入 bill_images.ocr_lines，比直接放在JSON列中小得多，且不随图片信息一起返回
+"""
+import json
+import zlib
+from typing import Dict, List, Optional
+
+def encode_ocr_lines(lines: List[Dict]) -> bytes:
+    """编码OCR文本行（extract_text_from_image 的输出格式）"""
+    compact = [[line["text"], round(float(line["confidence"]), 4), line["bbox"]] for line in lines]
+    return zlib.compress(json.dumps(compact, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def decode_ocr_lines(data: Optional[bytes]) -> Optional[List[Dict]]:
+    """解码为 [{"text", "confidence", "bbox"}]，没有数据时返回 None"""
+    if data is None:
+        return None
+    compact = json.loads(zlib.decompress(data).decode("utf-8"))
+    return [{"text": text, "confidence": confidence, "bbox": bbox} for text, confidence, bbox in compact]
@@ -2,50 +2,104 @@
 OCR账单解析工具
 支持解析支付宝和微信账单图片
 """
-import re
-from datetime import datetime
-from decimal import Decimal
-from typing import Optional, Dict, List
+import time
+import hashlib
+import threading
+from importlib.metadata import version as package_version
+from typing import Optional, Dict, List, Tuple
 from pathlib import Path
 import cv2
 import numpy as np
 from PIL import Image
-from paddleocr import PaddleOCR
+from config import settings
+from utils.field_extractor import PARSER_VERSION, detect_provider, extract_fields, scan_texts
+from utils.ocr_cache import OcrResultCache, file_digest
+from utils.preprocess import PreprocessConfig, PreprocessResult, run_pipeline
 
-# 初始化PaddleOCR（只初始化一次，提高性能）
-ocr = PaddleOCR(use_angle_cls=True, lang='ch', use_gpu=False)
+# PaddleOCR 实例在首次使用时才加载（只加载一次），导入本模块不会加载 paddle 和模型
+_ocr_engine = None
+_ocr_engine_lock = threading.Lock()
 
-def preprocess_image(image_path: str) -> np.ndarray:
+def get_ocr_engine():
+    """获取PaddleOCR实例（线程安全的懒加载单例）"""
+    global _ocr_engine
+    if _ocr_engine is None:
+        with _ocr_engine_lock:
+            if _ocr_engine is None:
+                from paddleocr import PaddleOCR
+                _ocr_engine = PaddleOCR(
+                    use_angle_cls=True,
+                    lang='ch',
+                    use_gpu=False,
+                    rec_batch_num=settings.OCR_REC_BATCH_NUM,
+                    cls_batch_num=settings.OCR_REC_BATCH_NUM
+                )
+    return _ocr_engine
+
+def warm_up_ocr():
+    """加载模型并用空白图片跑一次推理，使首个真实请求不承担初始化开销"""
+    engine = get_ocr_engine()
+    engine.ocr(np.full((64, 256, 3), 255, dtype=np.uint8), cls=True)
+
+# OCR模型版本与预处理参数，参与缓存键计算；升级模型或修改预处理时缓存自动失效
+OCR_MODEL_VERSION = f"paddleocr-{package_version('paddleocr')}-ch-cls"
+PREPROCESS_CONFIG = PreprocessConfig(
+    profile=settings.OCR_PREPROCESS_PROFILE,
+    target_long_side=settings.OCR_TARGET_LONG_SIDE,
+    target_text_height=settings.OCR_TARGET_TEXT_HEIGHT,
+    roi_crop=settings.OCR_ROI_CROP
+)
+def ocr_version(bill_type: Optional[str] = None) -> str:
     """
-    图像预处理：增强对比度、去噪等
+    识别结果的版本：模型 + 预处理参数
+    带账单类型提示时只识别该类账单的字段区域，版本与整图识别（OCR_VERSION）不同，这样的文本行不能当作整图结果复用
     """
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"无法读取图片: {image_path}")
-    
-    # 转换为灰度图
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # 增强对比度
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    enhanced = clahe.apply(gray)
-    
-    # 去噪
-    denoised = cv2.fastNlMeansDenoising(enhanced, None, 10, 7, 21)
-    
-    return denoised
+    return f"{OCR_MODEL_VERSION}|{PREPROCESS_CONFIG.signature(bill_type)}"
 
-def extract_text_from_image(image_path: str) -> List[Dict]:
+# 整图识别结果的版本：模型或预处理参数变化后，已保存的OCR文本行不再视为有效
+OCR_VERSION = ocr_version()
+
+# OCR结果缓存（内存LRU + 磁盘）
+ocr_cache = OcrResultCache(
+    settings.OCR_CACHE_MEMORY_SIZE, settings.OCR_CACHE_DIR or None, settings.OCR_CACHE_DISK_MAX_BYTES
+)
+
+def ocr_cache_key(image_path: str, digest: Optional[str] = None, bill_type: Optional[str] = None) -> str:
     """
-    从图片中提取文本（OCR）
-    返回格式: [{"text": "文本", "confidence": 0.95, "bbox": [x1, y1, x2, y2]}]
+    计算OCR缓存键：图片内容SHA-256 + 模型版本 + 预处理参数
+    - digest: 已知的图片内容SHA-256，省去重复读取文件
+    - bill_type: 预处理使用的账单类型提示（裁剪区域不同，结果分开缓存）
+    """
+    digest = digest or file_digest(image_path)
+    signature = PREPROCESS_CONFIG.signature(bill_type)
+    return hashlib.sha256(f"{digest}|{OCR_MODEL_VERSION}|{signature}".encode()).hexdigest()
+
+def preprocess_image(image_path: str, bill_type: Optional[str] = None) -> PreprocessResult:
+    """
+    图像预处理：按 OCR_PREPROCESS_PROFILE 选择的方案执行（见 utils/preprocess.py）
+    返回处理后的图片、缩放比例/裁剪偏移和各阶段耗时
+    - bill_type: 已知的账单类型，只保留该类账单的字段区域
+    """
+    return run_pipeline(image_path, PREPROCESS_CONFIG, bill_type)
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def extract_text_timed(image_path: str, bill_type: Optional[str] = None) -> Tuple[List[Dict], Dict[str, float]]:
+    """
+    从图片中提取文本（OCR），同时返回各阶段耗时（毫秒）
+    文本框坐标已映射回原图
+    - bill_type: 已知的账单类型提示，见 preprocess_image
     """
     try:
         # 预处理图像
-        processed_img = preprocess_image(image_path)
+        processed = preprocess_image(image_path, bill_type)
+        timings = dict(processed.timings)
         
         # OCR识别
-        result = ocr.ocr(processed_img, cls=True)
+        start = time.perf_counter()
+        result = get_ocr_engine().ocr(processed.image, cls=True)
+        timings["ocr"] = _elapsed_ms(start)
         
         # 格式化结果
         texts = []
@@ -53,231 +107,178 @@ def extract_text_from_image(image_path: str) -> List[Dict]:
             for line in result[0]:
                 if line:
                     bbox, (text, confidence) = line
-                    texts.append({
-                        "text": text,
-                        "confidence": confidence,
-                        "bbox": [int(coord[0]) for coord in bbox] + [int(coord[1]) for coord in bbox]
-                    })
+                    texts.append(_format_ocr_line(processed.to_original(bbox), text, confidence))
         
-        return texts
+        return texts, timings
     except Exception as e:
         raise Exception(f"OCR识别失败: {str(e)}")
 
-def detect_bill_type(texts: List[Dict]) -> str:
+def extract_text_from_image(image_path: str) -> List[Dict]:
     """
-    检测账单类型（支付宝/微信）
+    从图片中提取文本（OCR）
+    返回格式: [{"text": "文本", "confidence": 0.95, "bbox": [x1, y1, x2, y2]}]
     """
-    full_text = " ".join([item["text"] for item in texts])
-    
-    # 检测支付宝关键词
-    alipay_keywords = ["支付宝", "Alipay", "收款", "付款", "余额", "账单"]
-    alipay_count = sum(1 for keyword in alipay_keywords if keyword in full_text)
-    
-    # 检测微信关键词
-    wechat_keywords = ["微信支付", "WeChat", "微信", "收款", "付款", "零钱"]
-    wechat_count = sum(1 for keyword in wechat_keywords if keyword in full_text)
-    
-    if alipay_count > wechat_count:
-        return "alipay"
-    elif wechat_count > 0:
-        return "wechat"
-    else:
-        return "unknown"
+    texts, _ = extract_text_timed(image_path)
+    return texts
 
-def parse_alipay_bill(texts: List[Dict]) -> Dict:
+def extract_text_cached(image_path: str, digest: Optional[str] = None,
+                        bill_type: Optional[str] = None) -> Tuple[List[Dict], Dict[str, float]]:
     """
-    解析支付宝账单
+    带缓存的OCR：同一张图片（内容相同）命中缓存时完全跳过 PaddleOCR
+    返回 (文本列表, 各阶段耗时)，命中缓存时耗时只有 cache 一项
     """
-    full_text = "\n".join([item["text"] for item in texts])
-    
-    result = {
-        "amount": None,
-        "date": None,
-        "merchant": None,
-        "category": "支出",
-        "type": "其他",
-        "description": ""
+    start = time.perf_counter()
+    key = ocr_cache_key(image_path, digest, bill_type)
+    texts = ocr_cache.get(key)
+    if texts is not None:
+        return texts, {"cache": _elapsed_ms(start)}
+    texts, timings = extract_text_timed(image_path, bill_type)
+    ocr_cache.put(key, texts)
+    return texts, timings
+
+def _format_ocr_line(bbox, text: str, confidence: float) -> Dict:
+    """将一行OCR结果格式化为 {"text", "confidence", "bbox"}"""
+    return {
+        "text": text,
+        "confidence": float(confidence),
+        "bbox": [int(coord[0]) for coord in bbox] + [int(coord[1]) for coord in bbox]
     }
+
+def extract_text_from_images(image_paths: List[str]) -> List:
+    """
+    批量OCR：逐张做文本检测，再把所有图片的文本行裁剪图合并，
+    按 rec_batch_num 分批送入方向分类和识别模型，最后按图片拆分结果。
+    相比逐张调用 ocr.ocr，识别阶段的批次更满，减少每次调用的模型开销。
     
-    # 提取金额（匹配 ¥123.45 或 123.45 元）
-    amount_patterns = [
-        r'[¥￥]\s*(\d+\.?\d*)',
-        r'(\d+\.?\d*)\s*元',
-        r'金额[：:]\s*[¥￥]?\s*(\d+\.?\d*)',
-        r'(\d+\.?\d*)\s*[元块]'
-    ]
-    for pattern in amount_patterns:
-        match = re.search(pattern, full_text)
-        if match:
-            try:
-                result["amount"] = Decimal(match.group(1))
-                break
-            except:
-                continue
+    返回列表与 image_paths 一一对应：成功为 (文本列表, 各阶段耗时) 元组（同 extract_text_timed），
+    失败（如图片无法读取）为对应的 Exception 对象。识别阶段的耗时按文本行数分摊到各图片
+    """
+    ocr = get_ocr_engine()
     
-    # 提取日期（匹配 2024-01-01 或 2024/01/01 或 2024年1月1日）
-    date_patterns = [
-        r'(\d{4})[年\-/](\d{1,2})[月\-/](\d{1,2})[日]?',
-        r'(\d{4})-(\d{2})-(\d{2})',
-        r'(\d{4})/(\d{2})/(\d{2})'
-    ]
-    for pattern in date_patterns:
-        match = re.search(pattern, full_text)
-        if match:
-            try:
-                year, month, day = match.groups()
-                result["date"] = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                break
-            except:
-                continue
+    # PaddleOCR 在导入时把自身目录加入 sys.path，这里复用其内部的排序与裁剪工具
+    from tools.infer.predict_system import sorted_boxes
+    from tools.infer.utility import get_rotate_crop_image
     
-    # 如果没有找到日期，使用当前日期
-    if not result["date"]:
-        result["date"] = datetime.now().strftime("%Y-%m-%d")
+    results: List = [None] * len(image_paths)
+    crops = []
+    owners = []  # 每个裁剪图对应的 (图片序号, 文本框)
+    preprocessed: Dict[int, PreprocessResult] = {}
     
-    # 提取商户名称（通常在"收款方"、"商户"等关键词后）
-    merchant_patterns = [
-        r'收款方[：:]\s*([^\n]+)',
-        r'商户[：:]\s*([^\n]+)',
-        r'商家[：:]\s*([^\n]+)',
-        r'收款人[：:]\s*([^\n]+)'
-    ]
-    for pattern in merchant_patterns:
-        match = re.search(pattern, full_text)
-        if match:
-            result["merchant"] = match.group(1).strip()
-            result["description"] = match.group(1).strip()
-            break
+    # 1. 预处理 + 文本检测（检测模型按单张图片推理）
+    for index, image_path in enumerate(image_paths):
+        try:
+            processed = preprocess_image(image_path)
+            processed_img = processed.image
+            if processed_img.ndim == 2:
+                processed_img = cv2.cvtColor(processed_img, cv2.COLOR_GRAY2BGR)
+            
+            start = time.perf_counter()
+            dt_boxes, _ = ocr.text_detector(processed_img)
+            processed.timings["detect"] = _elapsed_ms(start)
+            preprocessed[index] = processed
+            results[index] = ([], processed.timings)
+            if dt_boxes is None or len(dt_boxes) == 0:
+                continue
+            
+            for box in sorted_boxes(dt_boxes):
+                crops.append(get_rotate_crop_image(processed_img, np.array(box, dtype=np.float32)))
+                owners.append((index, box))
+        except Exception as e:
+            results[index] = Exception(f"OCR识别失败: {str(e)}")
     
-    # 判断收入/支出（支付宝通常显示"收款"为收入，"付款"为支出）
-    if "收款" in full_text or "收入" in full_text:
-        result["category"] = "收入"
-    elif "付款" in full_text or "支出" in full_text:
-        result["category"] = "支出"
+    if not crops:
+        return results
     
-    # 提取类型（餐饮、交通等）
-    type_keywords = {
-        "餐饮": ["餐饮", "餐厅", "饭店", "美食", "外卖"],
-        "交通": ["交通", "打车", "地铁", "公交", "滴滴", "出租车"],
-        "购物": ["购物", "商城", "超市", "商店", "购买"],
-        "娱乐": ["娱乐", "电影", "KTV", "游戏"],
-        "工资": ["工资", "薪资", "收入"],
-        "奖金": ["奖金", "奖励"]
-    }
+    # 2. 所有图片的文本行一起做方向分类和识别，批次大小由 rec_batch_num 控制
+    try:
+        start = time.perf_counter()
+        if ocr.use_angle_cls:
+            crops, _, _ = ocr.text_classifier(crops)
+        rec_res, _ = ocr.text_recognizer(crops)
+        recognize_ms = _elapsed_ms(start)
+    except Exception as e:
+        error = Exception(f"OCR识别失败: {str(e)}")
+        return [error if isinstance(item, tuple) else item for item in results]
     
-    for bill_type, keywords in type_keywords.items():
-        if any(keyword in full_text for keyword in keywords):
-            result["type"] = bill_type
-            break
+    # 3. 按图片拆分，过滤低置信度结果（与 ocr.ocr 的 drop_score 一致），坐标映射回原图
+    line_counts: Dict[int, int] = {}
+    for (index, box), (text, confidence) in zip(owners, rec_res):
+        line_counts[index] = line_counts.get(index, 0) + 1
+        if confidence >= ocr.drop_score:
+            results[index][0].append(_format_ocr_line(preprocessed[index].to_original(box), text, confidence))
     
-    # 如果没有找到商户名，尝试从描述中提取
-    if not result["merchant"]:
-        # 尝试提取第一行非金额、非日期的文本作为商户名
-        for item in texts[:5]:  # 前5行
-            text = item["text"].strip()
-            if text and not re.match(r'^[¥￥]?\d+\.?\d*', text) and not re.match(r'^\d{4}', text):
-                result["merchant"] = text
-                result["description"] = text
-                break
+    for index, count in line_counts.items():
+        results[index][1]["recognize"] = round(recognize_ms * count / len(owners), 2)
     
-    return result
+    return results
+
+def detect_bill_type(texts: List[Dict]) -> str:
+    """
+    检测账单类型（支付宝/微信）
+    """
+    return detect_provider(scan_texts(texts))
+
+def parse_alipay_bill(texts: List[Dict]) -> Dict:
+    """
+    解析支付宝账单
+    """
+    return extract_fields(scan_texts(texts), "alipay")
 
 def parse_wechat_bill(texts: List[Dict]) -> Dict:
     """
     解析微信账单
     """
-    full_text = "\n".join([item["text"] for item in texts])
-    
-    result = {
-        "amount": None,
-        "date": None,
-        "merchant": None,
-        "category": "支出",
-        "type": "其他",
-        "description": ""
-    }
-    
-    # 提取金额
-    amount_patterns = [
-        r'[¥￥]\s*(\d+\.?\d*)',
-        r'(\d+\.?\d*)\s*元',
-        r'金额[：:]\s*[¥￥]?\s*(\d+\.?\d*)',
-        r'(\d+\.?\d*)\s*[元块]'
-    ]
-    for pattern in amount_patterns:
-        match = re.search(pattern, full_text)
-        if match:
-            try:
-                result["amount"] = Decimal(match.group(1))
-                break
-            except:
-                continue
-    
-    # 提取日期
-    date_patterns = [
-        r'(\d{4})[年\-/](\d{1,2})[月\-/](\d{1,2})[日]?',
-        r'(\d{4})-(\d{2})-(\d{2})',
-        r'(\d{4})/(\d{2})/(\d{2})'
-    ]
-    for pattern in date_patterns:
-        match = re.search(pattern, full_text)
-        if match:
-            try:
-                year, month, day = match.groups()
-                result["date"] = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                break
-            except:
-                continue
+    return extract_fields(scan_texts(texts), "wechat")
+
+def parse_bill_texts(texts: List[Dict], timings: Optional[Dict[str, float]] = None,
+                     ocr_version: Optional[str] = None) -> Dict:
+    """
+    从OCR文本中解析账单（不涉及图片处理，可单独调用）
+    返回解析结果和账单类型；无论成功与否都保留OCR文本行（ocr_results）及其OCR版本（ocr_version），
+    以及解析规则版本（parser_version），OCR版本未变时重新解析可以直接复用这些文本行
+    - timings: OCR各阶段耗时（毫秒），传入时连同解析耗时一起放入结果的 timings 字段
+    - ocr_version: 文本行对应的OCR版本，默认为当前版本
+    """
+    start = time.perf_counter()
+    result = _parse_bill_texts(texts)
+    result.setdefault("ocr_results", texts)
+    result["ocr_version"] = ocr_version or OCR_VERSION
+    result["parser_version"] = PARSER_VERSION
+    if timings is not None:
+        result["timings"] = {**timings, "parse": _elapsed_ms(start)}
+    return result
+
+def _parse_bill_texts(texts: List[Dict]) -> Dict:
+    if not texts:
+        return {
+            "success": False,
+            "error": "未能识别到任何文本",
+            "bill_type": "unknown"
+        }
     
-    if not result["date"]:
-        result["date"] = datetime.now().strftime("%Y-%m-%d")
+    # 关键词只扫描一遍，识别账单类型和解析字段共用
+    scanned = scan_texts(texts)
+    bill_type = detect_provider(scanned)
     
-    # 提取商户名称
-    merchant_patterns = [
-        r'收款方[：:]\s*([^\n]+)',
-        r'商户[：:]\s*([^\n]+)',
-        r'商家[：:]\s*([^\n]+)',
-        r'收款人[：:]\s*([^\n]+)',
-        r'对方[：:]\s*([^\n]+)'
-    ]
-    for pattern in merchant_patterns:
-        match = re.search(pattern, full_text)
-        if match:
-            result["merchant"] = match.group(1).strip()
-            result["description"] = match.group(1).strip()
-            break
+    # 根据类型解析，未知类型使用默认（支付宝）规则
+    parsed_data = extract_fields(scanned, bill_type)
     
-    # 判断收入/支出
-    if "收款" in full_text or "收入" in full_text or "收到" in full_text:
-        result["category"] = "收入"
-    elif "付款" in full_text or "支出" in full_text or "支付" in full_text:
-        result["category"] = "支出"
+    # 验证必要字段
+    if not parsed_data.get("amount"):
+        return {
+            "success": False,
+            "error": "未能识别到金额信息",
+            "bill_type": bill_type,
+            "raw_texts": [item["text"] for item in texts]
+        }
     
-    # 提取类型
-    type_keywords = {
-        "餐饮": ["餐饮", "餐厅", "饭店", "美食", "外卖"],
-        "交通": ["交通", "打车", "地铁", "公交", "滴滴", "出租车"],
-        "购物": ["购物", "商城", "超市", "商店", "购买"],
-        "娱乐": ["娱乐", "电影", "KTV", "游戏"],
-        "工资": ["工资", "薪资", "收入"],
-        "奖金": ["奖金", "奖励"]
+    return {
+        "success": True,
+        "bill_type": bill_type,
+        "parsed_data": parsed_data,
+        "raw_texts": [item["text"] for item in texts],
+        "ocr_results": texts
     }
-    
-    for bill_type, keywords in type_keywords.items():
-        if any(keyword in full_text for keyword in keywords):
-            result["type"] = bill_type
-            break
-    
-    # 如果没有找到商户名，尝试从描述中提取
-    if not result["merchant"]:
-        for item in texts[:5]:
-            text = item["text"].strip()
-            if text and not re.match(r'^[¥￥]?\d+\.?\d*', text) and not re.match(r'^\d{4}', text):
-                result["merchant"] = text
-                result["description"] = text
-                break
-    
-    return result
 
 def parse_bill_image(image_path: str) -> Dict:
     """
@@ -285,44 +286,9 @@ def parse_bill_image(image_path: str) -> Dict:
     返回解析结果和账单类型
     """
     try:
-        # OCR识别
-        texts = extract_text_from_image(image_path)
-        
-        if not texts:
-            return {
-                "success": False,
-                "error": "未能识别到任何文本",
-                "bill_type": "unknown"
-            }
-        
-        # 检测账单类型
-        bill_type = detect_bill_type(texts)
-        
-        # 根据类型解析
-        if bill_type == "alipay":
-            parsed_data = parse_alipay_bill(texts)
-        elif bill_type == "wechat":
-            parsed_data = parse_wechat_bill(texts)
-        else:
-            # 未知类型，尝试通用解析
-            parsed_data = parse_alipay_bill(texts)  # 使用支付宝解析器作为默认
-        
-        # 验证必要字段
-        if not parsed_data.get("amount"):
-            return {
-                "success": False,
-                "error": "未能识别到金额信息",
-                "bill_type": bill_type,
-                "raw_texts": [item["text"] for item in texts]
-            }
-        
-        return {
-            "success": True,
-            "bill_type": bill_type,
-            "parsed_data": parsed_data,
-            "raw_texts": [item["text"] for item in texts],
-            "ocr_results": texts
-        }
+        # OCR识别（优先使用缓存）
+        texts, timings = extract_text_cached(image_path)
+        return parse_bill_texts(texts, timings)
     except Exception as e:
         return {
             "success": False,
@@ -12,6 +12,18 @@ CREATE TABLE IF NOT EXISTS `users` (
   INDEX `idx_email` (`email`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='用户表';
 
+-- 已吊销刷新令牌表
+CREATE TABLE IF NOT EXISTS `revoked_tokens` (
+  `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '记录ID（各进程按ID增量同步吊销列表）',
+  `jti` VARCHAR(64) NOT NULL UNIQUE COMMENT '刷新令牌ID',
+  `user_id` INT NOT NULL COMMENT '用户ID',
+  `expires_at` DATETIME NOT NULL COMMENT '令牌过期时间（过期后记录可删除）',
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '吊销时间',
+  FOREIGN KEY (`user_id`) REFERENCES `users`(`id`) ON DELETE CASCADE,
+  INDEX `idx_user_id` (`user_id`),
+  INDEX `idx_expires_at` (`expires_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='已吊销刷新令牌表';
+
 -- 账单表
 CREATE TABLE IF NOT EXISTS `bills` (
   `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '账单ID',
@@ -22,14 +34,31 @@ CREATE TABLE IF NOT EXISTS `bills` (
   `type` VARCHAR(50) NOT NULL COMMENT '类型（如：餐饮、交通、工资等）',
   `description` TEXT COMMENT '描述',
   `bill_date` DATE NOT NULL COMMENT '账单日期',
+  `external_id` VARCHAR(64) COMMENT '支付宝/微信交易单号（账单明细导入）',
   `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
   `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
   FOREIGN KEY (`user_id`) REFERENCES `users`(`id`) ON DELETE CASCADE,
   INDEX `idx_user_id` (`user_id`),
   INDEX `idx_bill_date` (`bill_date`),
-  INDEX `idx_category` (`category`)
+  INDEX `idx_category` (`category`),
+  INDEX `idx_user_date_category_type_amount` (`user_id`, `bill_date`, `category`, `type`, `amount`) COMMENT '统计查询覆盖索引',
+  INDEX `idx_user_date_id` (`user_id`, `bill_date`, `id`) COMMENT '账单列表游标分页',
+  UNIQUE KEY `uq_bill_user_external_id` (`user_id`, `external_id`) COMMENT '账单明细导入去重'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='账单表';
 
+-- 账单按月汇总表（随账单增删改在同一事务内更新，统计查询的整月部分读此表）
+CREATE TABLE IF NOT EXISTS `bill_monthly_rollups` (
+  `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '汇总行ID',
+  `user_id` INT NOT NULL COMMENT '用户ID',
+  `month` DATE NOT NULL COMMENT '月份（当月第一天）',
+  `category` VARCHAR(50) NOT NULL COMMENT '分类（收入/支出）',
+  `type` VARCHAR(50) NOT NULL COMMENT '类型',
+  `total_amount` DECIMAL(14, 2) NOT NULL DEFAULT 0 COMMENT '金额合计',
+  `bill_count` INT NOT NULL DEFAULT 0 COMMENT '账单数',
+  FOREIGN KEY (`user_id`) REFERENCES `users`(`id`) ON DELETE CASCADE,
+  UNIQUE KEY `uq_rollup_user_month_category_type` (`user_id`, `month`, `category`, `type`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='账单按月汇总表';
+
 -- 账单图片表
 CREATE TABLE IF NOT EXISTS `bill_images` (
   `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '图片ID',
@@ -40,9 +69,13 @@ CREATE TABLE IF NOT EXISTS `bill_images` (
   `file_size` INT NOT NULL COMMENT '文件大小（字节）',
   `mime_type` VARCHAR(100) NOT NULL COMMENT 'MIME类型',
   `source_type` VARCHAR(50) COMMENT '来源类型（alipay/wechat/manual）',
-  `ocr_result` JSON COMMENT 'OCR识别结果',
+  `ocr_result` JSON COMMENT '解析结果',
+  `ocr_lines` MEDIUMBLOB COMMENT 'OCR原始文本行（zlib压缩的紧凑JSON）',
+  `ocr_model_version` VARCHAR(255) COMMENT 'OCR版本（模型+预处理参数）',
+  `parser_version` VARCHAR(20) COMMENT '解析规则版本',
   `parse_status` VARCHAR(50) DEFAULT 'pending' COMMENT '解析状态（pending/success/failed）',
   `parse_error` TEXT COMMENT '解析错误信息',
+  `content_hash` CHAR(64) COMMENT '图片内容SHA-256',
   `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
   `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
   FOREIGN KEY (`bill_id`) REFERENCES `bills`(`id`) ON DELETE CASCADE,
@@ -50,5 +83,66 @@ CREATE TABLE IF NOT EXISTS `bill_images` (
   INDEX `idx_bill_id` (`bill_id`),
   INDEX `idx_user_id` (`user_id`),
   INDEX `idx_source_type` (`source_type`),
-  INDEX `idx_parse_status` (`parse_status`)
+  INDEX `idx_parse_status` (`parse_status`),
+  INDEX `idx_user_content_hash` (`user_id`, `content_hash`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='账单图片表';
+
+-- 图片文件表（按内容去重存储）
+CREATE TABLE IF NOT EXISTS `image_blobs` (
+  `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '文件ID',
+  `content_hash` CHAR(64) NOT NULL UNIQUE COMMENT '文件内容SHA-256',
+  `file_path` VARCHAR(500) NOT NULL COMMENT '文件路径',
+  `file_size` INT NOT NULL COMMENT '文件大小（字节）',
+  `ref_count` INT NOT NULL DEFAULT 0 COMMENT '引用该文件的图片记录数',
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='图片文件表';
+
+-- OCR任务队列表
+CREATE TABLE IF NOT EXISTS `ocr_jobs` (
+  `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '任务ID',
+  `image_id` INT NOT NULL COMMENT '图片ID',
+  `user_id` INT NOT NULL COMMENT '用户ID',
+  `auto_create_bill` TINYINT(1) NOT NULL DEFAULT 1 COMMENT '解析成功后是否自动创建账单',
+  `status` VARCHAR(20) NOT NULL DEFAULT 'queued' COMMENT '任务状态（queued/running/done/failed）',
+  `attempts` INT NOT NULL DEFAULT 0 COMMENT '已尝试次数',
+  `error` TEXT COMMENT '错误信息',
+  `started_at` DATETIME COMMENT '开始处理时间',
+  `finished_at` DATETIME COMMENT '完成时间',
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  FOREIGN KEY (`image_id`) REFERENCES `bill_images`(`id`) ON DELETE CASCADE,
+  FOREIGN KEY (`user_id`) REFERENCES `users`(`id`) ON DELETE CASCADE,
+  INDEX `idx_image_id` (`image_id`),
+  INDEX `idx_user_id` (`user_id`),
+  INDEX `idx_status` (`status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='OCR任务队列表';
+
+-- 批量重新解析任务表
+CREATE TABLE IF NOT EXISTS `reparse_jobs` (
+  `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '任务ID',
+  `user_id` INT COMMENT '筛选的用户ID（为空表示所有用户）',
+  `date_from` DATE COMMENT '图片上传日期起',
+  `date_to` DATE COMMENT '图片上传日期止',
+  `parse_status` VARCHAR(20) COMMENT '筛选的解析状态',
+  `source_type` VARCHAR(20) COMMENT '筛选的账单来源',
+  `ocr_mode` VARCHAR(10) NOT NULL DEFAULT 'auto' COMMENT 'auto: OCR文本有效时只重新解析文本；always: 总是重新OCR',
+  `auto_create_bill` TINYINT(1) NOT NULL DEFAULT 0 COMMENT '解析成功且未关联账单时是否创建账单',
+  `status` VARCHAR(20) NOT NULL DEFAULT 'queued' COMMENT '任务状态（queued/running/done/failed/cancelled）',
+  `cursor_id` INT NOT NULL DEFAULT 0 COMMENT '已处理到的图片ID',
+  `total` INT NOT NULL DEFAULT 0 COMMENT '待处理图片总数',
+  `processed` INT NOT NULL DEFAULT 0 COMMENT '已处理数量',
+  `skipped` INT NOT NULL DEFAULT 0 COMMENT '版本未变化跳过的数量',
+  `text_only` INT NOT NULL DEFAULT 0 COMMENT '复用OCR文本的数量',
+  `reocr` INT NOT NULL DEFAULT 0 COMMENT '重新OCR的数量',
+  `succeeded` INT NOT NULL DEFAULT 0 COMMENT '解析成功数量',
+  `failed` INT NOT NULL DEFAULT 0 COMMENT '解析失败数量',
+  `elapsed_seconds` DOUBLE NOT NULL DEFAULT 0 COMMENT '累计运行秒数',
+  `error` TEXT COMMENT '错误信息',
+  `started_at` DATETIME COMMENT '开始时间',
+  `finished_at` DATETIME COMMENT '完成时间',
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  FOREIGN KEY (`user_id`) REFERENCES `users`(`id`) ON DELETE CASCADE,
+  INDEX `idx_user_id` (`user_id`),
+  INDEX `idx_status` (`status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='批量重新解析任务表';
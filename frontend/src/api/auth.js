@@ -12,6 +12,14 @@ export const authApi = {
     return api.post('/auth/register', userData)
   },
   
+  refresh: (refreshToken) => {
+    return api.post('/auth/refresh', { refresh_token: refreshToken })
+  },
+  
+  logout: (refreshToken) => {
+    return api.post('/auth/logout', { refresh_token: refreshToken })
+  },
+  
   getCurrentUser: () => {
     return api.get('/auth/me')
   }
@@ -26,9 +26,18 @@ api.interceptors.response.use(
   (response) => {
     return response
   },
-  (error) => {
+  async (error) => {
     if (error.response?.status === 401) {
       const authStore = useAuthStore()
+      const config = error.config
+      // 访问令牌过期：用刷新令牌换取新令牌后重试一次（登录、刷新请求本身除外）
+      if (authStore.refreshToken && !config._retried && !['/auth/login', '/auth/refresh'].includes(config.url)) {
+        config._retried = true
+        if (await authStore.refreshAccessToken()) {
+          config.headers.Authorization = `Bearer ${authStore.token}`
+          return api(config)
+        }
+      }
       authStore.logout()
       router.push('/login')
     }
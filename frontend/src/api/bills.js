@@ -23,5 +23,46 @@ export const billsApi = {
   
   getStatistics: (params = {}) => {
     return api.get('/bills/statistics/summary', { params })
+  },
+  
+  getTimeseries: (params = {}) => {
+    return api.get('/bills/statistics/timeseries', { params })
+  },
+  
+  getBreakdown: (params = {}) => {
+    return api.get('/bills/statistics/breakdown', { params })
+  },
+  
+  createBillsBulk: (bills) => {
+    return api.post('/bills/bulk', bills, { timeout: 0 })
+  },
+  
+  // 从CSV导入账单
+  importBills: (file) => {
+    const formData = new FormData()
+    formData.append('file', file)
+    return api.post('/bills/import', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+      timeout: 0
+    })
+  },
+  
+  // 导入支付宝/微信账单明细CSV
+  importStatement: (file) => {
+    const formData = new FormData()
+    formData.append('file', file)
+    return api.post('/bills/import/statement', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+      timeout: 0
+    })
+  },
+  
+  // 导出账单（params.format: csv/ndjson，params.gzip: 是否压缩）
+  exportBills: (params = {}) => {
+    return api.get('/bills/export', {
+      params,
+      responseType: 'blob',
+      timeout: 0
+    })
   }
 }
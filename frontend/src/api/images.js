@@ -34,6 +34,14 @@ export const imagesApi = {
     return api.get(`/images/${id}`)
   },
   
+  // 查询图片解析状态（wait: 长轮询等待秒数）
+  getImageStatus: (id, wait = 0) => {
+    return api.get(`/images/${id}/status`, {
+      params: { wait },
+      timeout: (wait + 10) * 1000
+    })
+  },
+  
   // 获取图片文件
   getImageFile: (id) => {
     return api.get(`/images/${id}/file`, {
@@ -5,7 +5,9 @@ import router from '../router'
 
 export const useAuthStore = defineStore('auth', () => {
   const token = ref(localStorage.getItem('token') || '')
+  const refreshToken = ref(localStorage.getItem('refreshToken') || '')
   const user = ref(null)
+  let refreshing = null
 
   const isAuthenticated = computed(() => !!token.value)
 
@@ -13,7 +15,9 @@ export const useAuthStore = defineStore('auth', () => {
     try {
       const response = await authApi.login(username, password)
       token.value = response.data.access_token
+      refreshToken.value = response.data.refresh_token
       localStorage.setItem('token', token.value)
+      localStorage.setItem('refreshToken', refreshToken.value)
       
       // 获取用户信息
       await fetchUserInfo()
@@ -48,10 +52,32 @@ export const useAuthStore = defineStore('auth', () => {
     }
   }
 
+  // 用刷新令牌换取新的访问令牌，同时收到多个401时只刷新一次
+  const refreshAccessToken = () => {
+    if (!refreshing) {
+      refreshing = authApi.refresh(refreshToken.value)
+        .then((response) => {
+          token.value = response.data.access_token
+          localStorage.setItem('token', token.value)
+          return true
+        })
+        .catch(() => false)
+        .finally(() => {
+          refreshing = null
+        })
+    }
+    return refreshing
+  }
+
   const logout = () => {
+    if (refreshToken.value) {
+      authApi.logout(refreshToken.value).catch(() => {})
+    }
     token.value = ''
+    refreshToken.value = ''
     user.value = null
     localStorage.removeItem('token')
+    localStorage.removeItem('refreshToken')
   }
 
   // 初始化时获取用户信息
@@ -61,11 +87,13 @@ export const useAuthStore = defineStore('auth', () => {
 
   return {
     token,
+    refreshToken,
     user,
     isAuthenticated,
     login,
     register,
     logout,
+    refreshAccessToken,
     fetchUserInfo
   }
 })
@@ -98,6 +98,9 @@ def test_single_image(image_path):
         
         elapsed = (end_time - start_time).total_seconds()
         print(f"⏱️  识别耗时: {elapsed:.2f} 秒")
+        if result.get("timings"):
+            stages = ", ".join(f"{name} {ms:.0f}ms" for name, ms in result["timings"].items())
+            print(f"   各阶段: {stages}")
         print()
         
         # 显示结果